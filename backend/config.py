@@ -46,6 +46,9 @@ class Settings(BaseSettings):
     supabase_url: str = ""
     supabase_anon_key: str = ""       # Public anon key — used for user-scoped JWT queries
     supabase_service_key: str = ""    # Service role — NEVER expose to frontend
+    # Optional direct Postgres DSN (service role) for pooled server-side writes.
+    # Leave empty to route everything through the Supabase client.
+    database_url: str = ""
 
     # --- Azure Document Intelligence (optional) ---
     azure_doc_intelligence_endpoint: str = ""
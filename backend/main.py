@@ -3,7 +3,11 @@ WellBridge FastAPI application entry point.
 
 Startup sequence:
   1. Load settings (fails fast if env vars missing)
+     Route logging through a QueueHandler → QueueListener so log calls on
+     the event loop only enqueue; formatting and stream I/O run on a
+     background thread.
   2. Compile the LangGraph agent graph (done once, reused per request)
+     Warm the upload path in the background (tokenizer, LlamaParse client)
   3. Start APScheduler — weekly data sync jobs:
        Sun 02:00 UTC — Epic SMART endpoint directory  (open.epic.com)
        Sun 03:00 UTC — CMS Doctors & Clinicians       (data.cms.gov)
@@ -13,7 +17,11 @@ Startup sequence:
   5. Mount routers
 """
 
+import asyncio
 import logging
+import logging.handlers
+import queue
+import ssl
 from contextlib import asynccontextmanager
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -24,11 +32,46 @@ from fastapi.middleware.cors import CORSMiddleware
 from config import get_settings
 from agent.graph import compile_graph
 from routers import chat, records, ocr, sharing, appointments, epic, users, speech
+from services.epic_fhir_service import close_client as close_epic_client
+from services.db_pool import close_pool
+from services.supabase_client import close_http_client as close_supabase_http
+from services import llama_parse_service, note_analysis_service
 
 log      = logging.getLogger("wellbridge")
 settings = get_settings()
 
 
+# ── Logging ───────────────────────────────────────────────────────────────────
+
+def _start_log_listener() -> logging.handlers.QueueListener:
+    """
+    Swap the root logger's handlers for a single QueueHandler and hand the
+    real handlers to a QueueListener thread.  log.info()/log.debug() on the
+    hot path (per-chunk embeddings, Epic parse loops) then costs an enqueue
+    instead of a synchronous write to stdout.
+    """
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    if not handlers:
+        stream = logging.StreamHandler()
+        stream.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+        handlers = [stream]
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(settings.log_level.upper())
+
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    return listener
+
+
 # ── Scheduled jobs ────────────────────────────────────────────────────────────
 
 async def _job_sync_epic():
@@ -47,13 +90,30 @@ async def _job_sync_cms():
     log.info("scheduler: CMS DAC sync → %s", result)
 
 
+def _warm_upload_path() -> None:
+    try:
+        note_analysis_service.warm_up()
+        llama_parse_service.warm_up()
+        log.info("startup: upload path warmed")
+    except Exception as exc:
+        log.warning("startup: upload path warm-up failed (non-blocking) — %s", exc)
+
+
 # ── Lifespan ──────────────────────────────────────────────────────────────────
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # 0. Move log I/O off the event loop
+    log_listener = _start_log_listener()
+    log.info("crypto: %s", ssl.OPENSSL_VERSION)
+
     # 1. Compile LangGraph state machine
     app.state.agent_graph = compile_graph()
 
+    # Warm the upload path (tokenizer file, LlamaParse client) on a worker
+    # thread so the first upload doesn't pay for it and startup isn't held up
+    warm_up = asyncio.create_task(asyncio.to_thread(_warm_upload_path))
+
     # 2. Start scheduler
     scheduler = AsyncIOScheduler(timezone="UTC")
     scheduler.add_job(
@@ -78,7 +138,12 @@ async def lifespan(app: FastAPI):
     yield
 
     # Shutdown
+    warm_up.cancel()
     scheduler.shutdown(wait=False)
+    await close_epic_client()
+    await close_pool()
+    close_supabase_http()
+    log_listener.stop()   # Flushes any queued records before exit
 
 
 # ── App ───────────────────────────────────────────────────────────────────────
@@ -18,6 +18,7 @@ Session creation now automatically sends a warm opener message from the agent,
 stored as an assistant message so it appears in history on reload.
 """
 
+import asyncio
 import json
 import logging
 from datetime import date
@@ -40,6 +41,10 @@ log = logging.getLogger("wellbridge.chat")
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# Caps concurrent LlamaParse / OpenAI work from uploads in this process so a
+# burst of uploads queues here instead of tripping provider rate limits.
+_ANALYSIS_SLOTS = asyncio.Semaphore(8)
+
 
 class ChatRequest(BaseModel):
     session_id: str
@@ -379,7 +384,8 @@ async def upload_note(
         # ── Step 1: Parse document with LlamaParse ───────────────────────────
         log.info("upload_note: step 1 — parsing with LlamaParse")
         try:
-            note_text = await parse_document(file_bytes, filename)
+            async with _ANALYSIS_SLOTS:
+                note_text = await parse_document(file_bytes, filename)
             log.info("upload_note: LlamaParse returned %d chars", len(note_text))
         except ValueError as exc:
             log.warning("upload_note: unsupported file type — %s", exc)
@@ -396,9 +402,16 @@ async def upload_note(
             )
 
         # ── Step 2: Analyze the note with GPT-4o ────────────────────────────
-        log.info("upload_note: step 2 — running GPT-4o note analysis")
+        # The content embedding for semantic search (step 3a) only needs the
+        # note text, so it runs alongside the analysis instead of after it.
+        log.info("upload_note: step 2 — running GPT-4o note analysis + content embedding")
+        content_to_store = note_text[:10000]
         try:
-            analysis = await analyze_note(note_text)
+            async with _ANALYSIS_SLOTS:
+                analysis, embedding = await asyncio.gather(
+                    analyze_note(note_text),
+                    get_embedding(content_to_store),   # Returns [] on failure
+                )
             log.info(
                 "upload_note: analysis done — %d prescriptions, %d appointments, %d referrals",
                 len(analysis.prescriptions),
@@ -408,6 +421,7 @@ async def upload_note(
         except Exception as exc:
             log.error("upload_note: analyze_note error — %s", exc, exc_info=True)
             raise
+        log.info("upload_note: embedding dims=%d", len(embedding))
 
         action_cards = build_action_cards(analysis)
         suggested_replies = build_upload_suggestions(analysis)
@@ -420,15 +434,6 @@ async def upload_note(
         # and patient_user_id values in the insert payload below.
         db = get_admin_client()
 
-        # Generate embedding for semantic search (non-blocking on failure)
-        log.info("upload_note: step 3a — generating content embedding")
-        content_to_store = note_text[:10000]
-        try:
-            embedding = await get_embedding(content_to_store)
-        except Exception:
-            embedding = []
-        log.info("upload_note: embedding dims=%d", len(embedding))
-
         try:
             insert_payload: dict = {
                 "tenant_id": ctx.tenant_id,
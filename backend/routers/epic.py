@@ -30,7 +30,7 @@ from services.epic_fhir_service import (
     refresh_access_token,
     fetch_patient_data,
     sync_fhir_data_to_db,
-    encrypt_token,
+    encrypt_tokens,
     decrypt_token,
 )
 from config import get_settings
@@ -105,9 +105,12 @@ async def _get_valid_token(connection: dict, db) -> str:
         datetime.now(timezone.utc) + timedelta(seconds=new_tokens.expires_in)
     ).isoformat()
 
+    access_enc, refresh_enc = encrypt_tokens(
+        [new_tokens.access_token, new_tokens.refresh_token or refresh_token]
+    )
     db.table("epic_connections").update({
-        "access_token_enc": encrypt_token(new_tokens.access_token),
-        "refresh_token_enc": encrypt_token(new_tokens.refresh_token or refresh_token),
+        "access_token_enc": access_enc,
+        "refresh_token_enc": refresh_enc,
         "token_expires_at": new_expires_at,
         "updated_at": datetime.now(timezone.utc).isoformat(),
     }).eq("id", connection["id"]).execute()
@@ -203,13 +206,16 @@ async def exchange(
             body.fhir_base_url,
         )
 
+        access_enc, *refresh_enc = encrypt_tokens(
+            [tokens.access_token] + ([tokens.refresh_token] if tokens.refresh_token else [])
+        )
         db.table("epic_connections").upsert({
             "tenant_id": ctx.tenant_id,
             "patient_user_id": ctx.user_id,
             "organization_name": org_name,
             "fhir_base_url": body.fhir_base_url,
-            "access_token_enc": encrypt_token(tokens.access_token),
-            "refresh_token_enc": encrypt_token(tokens.refresh_token) if tokens.refresh_token else None,
+            "access_token_enc": access_enc,
+            "refresh_token_enc": refresh_enc[0] if refresh_enc else None,
             "token_expires_at": expires_at,
             "scope": tokens.scope,
             "patient_fhir_id": patient_fhir_id,
@@ -231,7 +237,7 @@ async def exchange(
                 access_token=tokens.access_token,
                 patient_id=patient_fhir_id,
             )
-            sync_result = sync_fhir_data_to_db(fhir_data, ctx.tenant_id, ctx.user_id, db)
+            sync_result = await sync_fhir_data_to_db(fhir_data, ctx.tenant_id, ctx.user_id, db)
 
             db.table("epic_connections").update({
                 "last_sync_at": datetime.now(timezone.utc).isoformat(),
@@ -311,7 +317,7 @@ async def sync(ctx: TenantContext = Depends(get_tenant_context)):
             access_token=access_token,
             patient_id=patient_id,
         )
-        sync_result = sync_fhir_data_to_db(fhir_data, ctx.tenant_id, ctx.user_id, db)
+        sync_result = await sync_fhir_data_to_db(fhir_data, ctx.tenant_id, ctx.user_id, db)
 
         db.table("epic_connections").update({
             "last_sync_at": datetime.now(timezone.utc).isoformat(),
@@ -0,0 +1,58 @@
+"""
+Direct Postgres connection pool (asyncpg).
+
+supabase-py sends every query as a separate PostgREST HTTP request.  For
+server-side writes that already run with the service role — and therefore
+bypass RLS anyway — a pooled asyncpg connection skips the HTTP hop, reuses
+the TCP/TLS session, and lets a batch of statements share one round-trip.
+
+User-scoped, RLS-enforced access keeps going through get_scoped_client().
+Only admin-path writes (e.g. journey_update_service) use this pool.
+
+The pool is optional: if DATABASE_URL is not set, get_pool() returns None and
+callers fall back to the Supabase admin client.
+
+DATABASE_URL must be a direct or session-mode pooler connection string —
+asyncpg's prepared statements do not survive transaction-mode pooling.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+
+from config import get_settings
+
+settings = get_settings()
+log = logging.getLogger("wellbridge.db_pool")
+
+_POOL: Optional[asyncpg.Pool] = None
+_POOL_LOCK = asyncio.Lock()
+
+
+async def get_pool() -> Optional[asyncpg.Pool]:
+    """Return the process-wide pool, creating it on first use. None if unconfigured."""
+    global _POOL
+    if not settings.database_url:
+        return None
+    if _POOL is None:
+        async with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = await asyncpg.create_pool(
+                    settings.database_url,
+                    min_size=10,
+                    max_size=50,
+                    max_inactive_connection_lifetime=300,
+                    command_timeout=60,
+                )
+                log.info("db_pool: connected (min=10, max=50)")
+    return _POOL
+
+
+async def close_pool() -> None:
+    """Close the pool on application shutdown."""
+    global _POOL
+    if _POOL is not None:
+        await _POOL.close()
+        _POOL = None
@@ -30,35 +30,100 @@ Developer registration (open.epic.com):
   See EPIC_DEVELOPER_REGISTRATION.md in the project root for full instructions.
 """
 
-import hashlib
-import json
+import asyncio
+import contextlib
 import logging
 import os
+import tempfile
 import time
-from base64 import urlsafe_b64encode
-from datetime import datetime, timezone
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from urllib.parse import urlencode
 
 import httpx
+import ijson
+import msgpack
+import orjson
 from cryptography.fernet import Fernet, InvalidToken
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 from config import get_settings
 
 settings = get_settings()
 log = logging.getLogger("wellbridge.epic")
 
+# Prefer ijson's C (yajl2) backend for streaming the local bundle; the
+# pure-Python backend is several times slower but always available.
+try:
+    _ijson = ijson.get_backend("yajl2_c")
+except ImportError:
+    _ijson = ijson
+
+# ── Shared HTTP client ────────────────────────────────────────────────────────
+# One process-wide AsyncClient so TCP/TLS connections (and HTTP/2 streams) to
+# Epic hosts are reused across requests instead of re-handshaking per call.
+# Created lazily; closed from the app lifespan via close_client().
+_CLIENT: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared Epic HTTP client, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+            headers={"Accept": "application/fhir+json"},
+        )
+    return _CLIENT
+
+
+async def close_client() -> None:
+    """Close the shared client. Called once at application shutdown."""
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+
 # ── Endpoint directory cache ──────────────────────────────────────────────────
 # Refreshed at most once per 24 h to avoid hammering Epic's servers.
-_ENDPOINT_CACHE: list[dict] = []
-_ENDPOINT_CACHE_TS: float = 0.0
+# Entries are (name_lower, url_lower, EpicEndpoint), built once per refresh so
+# searches never re-lowercase strings or re-validate models.
+_ENDPOINT_CACHE: list[tuple[str, str, "EpicEndpoint"]] = []
+# Positions into _ENDPOINT_CACHE sorted by name_lower, plus the parallel sorted
+# keys — lets prefix searches bisect instead of scanning every entry.
+_ENDPOINT_NAME_ORDER: list[int] = []
+_ENDPOINT_NAME_KEYS: list[str] = []
+# Bumped on every refresh; part of the search memo key so stale results miss.
+_ENDPOINT_CACHE_GEN: int = 0
+# time.monotonic() of the last successful load; None until the first one.
+# Monotonic so NTP / wall-clock jumps can't expire or pin the cache.
+_ENDPOINT_CACHE_TS: float | None = None
 _ENDPOINT_CACHE_TTL: float = 86400.0  # 24 hours
+# After a failed load, how long callers reuse whatever is cached (possibly
+# nothing) before trying again — keeps an Epic outage from queueing one 20 s
+# fetch per request behind _ENDPOINT_LOCK.
+_ENDPOINT_RETRY_AFTER: float = 30.0
+# Serialises refreshes so concurrent callers at expiry trigger one load, not N.
+_ENDPOINT_LOCK = asyncio.Lock()
+# Validators from the last network fetch — lets the 24 h refresh send a
+# conditional GET and skip the multi-MB body when the directory is unchanged.
+_ENDPOINT_ETAG: str | None = None
+_ENDPOINT_LASTMOD: str | None = None
 
 # Local Brands Bundle file (place epic_endpoint_DSTU2.json in the backend folder)
 _LOCAL_BUNDLE_PATH = Path(__file__).parent.parent / "epic_endpoint_DSTU2.json"
 
+# Pre-parsed endpoint index written next to the bundle after the first parse.
+# Stamped with the bundle's (mtime_ns, size) so a replaced bundle is re-parsed.
+_INDEX_CACHE_PATH = _LOCAL_BUNDLE_PATH.with_suffix(".idx.msgpack")
+
 # Epic's public FHIR R4 endpoint bundle — used only if local file is absent
 EPIC_ENDPOINT_BUNDLE_URL = "https://open.epic.com/Endpoints/R4"
 
@@ -100,7 +165,13 @@ class TokenResponse(BaseModel):
 
 # ── Token encryption ──────────────────────────────────────────────────────────
 
+@lru_cache(maxsize=1)
 def _get_fernet() -> Fernet:
+    """
+    Build the Fernet instance once per process — settings are themselves
+    cached, so the key cannot change underneath it.  A missing key raises
+    every time (exceptions are not memoised).
+    """
     key = settings.epic_token_encryption_key
     if not key:
         raise RuntimeError(
@@ -121,47 +192,241 @@ def decrypt_token(encrypted: str) -> str:
     return _get_fernet().decrypt(encrypted.encode()).decode()
 
 
+def encrypt_tokens(tokens: list[str]) -> list[str]:
+    """
+    Encrypt several tokens for DB storage in one pass (e.g. access + refresh).
+    Shares one Fernet instance and one timestamp across the batch.
+    """
+    fernet = _get_fernet()
+    now = int(time.time())
+    return [fernet.encrypt_at_time(t.encode(), now).decode() for t in tokens]
+
+
 # ── Endpoint directory ────────────────────────────────────────────────────────
 
+def _endpoint_from_resource(resource: dict) -> dict | None:
+    """Map an active FHIR Endpoint resource to an endpoint dict, else None."""
+    if resource.get("resourceType") != "Endpoint":
+        return None
+    if resource.get("status") != "active":
+        return None
+    address = resource.get("address", "")
+    if not address:
+        return None
+    name = resource.get("name") or resource.get("id", "Unknown")
+    return {"organization_name": str(name), "fhir_base_url": str(address)}
+
+
 def _parse_bundle_entries(bundle: dict) -> list[dict]:
     """Extract active Endpoint resources from a FHIR Bundle."""
     endpoints: list[dict] = []
     for entry in bundle.get("entry", []):
-        resource = entry.get("resource", {})
-        if resource.get("resourceType") != "Endpoint":
-            continue
-        if resource.get("status") != "active":
-            continue
-        name = resource.get("name") or resource.get("id", "Unknown")
-        address = resource.get("address", "")
-        if address:
-            endpoints.append({"organization_name": name, "fhir_base_url": address})
+        endpoint = _endpoint_from_resource(entry.get("resource", {}))
+        if endpoint:
+            endpoints.append(endpoint)
     return endpoints
 
 
+def _read_index_cache(stamp: list[int]) -> list[dict] | None:
+    """Return endpoints from the msgpack index if it matches *stamp*, else None."""
+    try:
+        cached_stamp, endpoints = msgpack.unpackb(
+            _INDEX_CACHE_PATH.read_bytes(), raw=False
+        )
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        log.warning("epic: ignoring unreadable endpoint index — %s", exc)
+        return None
+    return endpoints if cached_stamp == stamp else None
+
+
+def _write_index_cache(stamp: list[int], endpoints: list[dict]) -> None:
+    """
+    Atomically write the msgpack index (temp file + os.replace).  Each writer
+    gets its own temp file, so workers starting together on a cold cache
+    can't interleave their bytes — the last complete file wins.
+    """
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=_INDEX_CACHE_PATH.parent,
+            prefix=_INDEX_CACHE_PATH.name + ".",
+            suffix=".tmp",
+            delete=False,
+        ) as tmp:
+            tmp_path = tmp.name
+            tmp.write(msgpack.packb([stamp, endpoints]))
+        os.replace(tmp_path, _INDEX_CACHE_PATH)
+    except OSError as exc:
+        log.warning("epic: failed to write endpoint index — %s", exc)
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+
+
 def _load_local_bundle() -> list[dict] | None:
     """
     Load and parse the local Brands Bundle JSON file.
     Returns the endpoint list, or None if the file is absent / unreadable.
-    The file is large (~85 MB) so we parse once at startup and cache the result.
+
+    The file is large (~85 MB), so it is stream-parsed with ijson one
+    entry.resource at a time and filtered inline — only the small
+    {organization_name, fhir_base_url} dicts are ever kept in memory,
+    instead of materialising the whole Bundle tree first.
+
+    The parsed list is also written to a msgpack index beside the bundle;
+    later cold starts unpack that in milliseconds instead of re-parsing.
     """
     if not _LOCAL_BUNDLE_PATH.exists():
         return None
     try:
-        with _LOCAL_BUNDLE_PATH.open("r", encoding="utf-8") as fh:
-            bundle = json.load(fh)
-        endpoints = _parse_bundle_entries(bundle)
+        st = _LOCAL_BUNDLE_PATH.stat()
+        stamp = [st.st_mtime_ns, st.st_size]
+
+        endpoints = _read_index_cache(stamp)
+        if endpoints is not None:
+            log.info(
+                "epic: loaded %d endpoints from index %s",
+                len(endpoints),
+                _INDEX_CACHE_PATH.name,
+            )
+            return endpoints
+
+        endpoints = []
+        with _LOCAL_BUNDLE_PATH.open("rb") as fh:
+            for resource in _ijson.items(fh, "entry.item.resource"):
+                endpoint = _endpoint_from_resource(resource)
+                if endpoint:
+                    endpoints.append(endpoint)
         log.info(
             "epic: loaded %d endpoints from local bundle %s",
             len(endpoints),
             _LOCAL_BUNDLE_PATH.name,
         )
+        _write_index_cache(stamp, endpoints)
         return endpoints
     except Exception as exc:
         log.warning("epic: failed to read local bundle — %s", exc)
         return None
 
 
+def _build_endpoint_index(endpoints: list[dict]) -> None:
+    """
+    Replace the search index with lowercased keys + models for *endpoints*.
+
+    Models are built here, once per refresh, with model_construct(): every
+    dict comes from _endpoint_from_resource() (or the index it wrote) with two
+    string fields, so per-entry validation would only re-check known data.
+    Searches then hand back these prebuilt instances.
+    """
+    global _ENDPOINT_CACHE, _ENDPOINT_NAME_ORDER, _ENDPOINT_NAME_KEYS, _ENDPOINT_CACHE_GEN
+    cache = [
+        (
+            e["organization_name"].lower(),
+            e["fhir_base_url"].lower(),
+            EpicEndpoint.model_construct(**e),
+        )
+        for e in endpoints
+    ]
+    order = sorted(range(len(cache)), key=lambda i: cache[i][0])
+    _ENDPOINT_CACHE = cache
+    _ENDPOINT_NAME_ORDER = order
+    _ENDPOINT_NAME_KEYS = [cache[i][0] for i in order]
+    _ENDPOINT_CACHE_GEN += 1
+    _search_endpoints.cache_clear()
+
+
+@lru_cache(maxsize=512)
+def _search_endpoints(query: str, gen: int, limit: int = 20) -> tuple[EpicEndpoint, ...]:
+    """
+    Match a lowercased query against the endpoint index.
+
+    Memoised on (query, gen): autocomplete traffic repeats the same few
+    prefixes, so most calls are a dict lookup.  *gen* is the cache
+    generation, so results from a previous refresh can never be returned.
+
+    Organisations whose name starts with the query come first (bisect on the
+    sorted names, O(log N + k)); remaining slots are filled by substring
+    matches on name or FHIR URL in directory order.
+    """
+    if not query:
+        return tuple(ep for _, _, ep in _ENDPOINT_CACHE[:50])
+
+    matches: list[EpicEndpoint] = []
+    pos = bisect_left(_ENDPOINT_NAME_KEYS, query)
+    while (
+        pos < len(_ENDPOINT_NAME_KEYS)
+        and _ENDPOINT_NAME_KEYS[pos].startswith(query)
+        and len(matches) < limit
+    ):
+        matches.append(_ENDPOINT_CACHE[_ENDPOINT_NAME_ORDER[pos]][2])
+        pos += 1
+    if len(matches) >= limit:
+        return tuple(matches)
+
+    for name, url, ep in _ENDPOINT_CACHE:
+        if name.startswith(query):
+            continue  # Already collected by the prefix pass
+        if query in name or query in url:
+            matches.append(ep)
+            if len(matches) >= limit:
+                break
+    return tuple(matches)
+
+
+def _endpoint_cache_stale() -> bool:
+    return (
+        _ENDPOINT_CACHE_TS is None
+        or time.monotonic() - _ENDPOINT_CACHE_TS > _ENDPOINT_CACHE_TTL
+    )
+
+
+async def _refresh_endpoint_cache() -> None:
+    """Reload the endpoint directory (local bundle, else network) into the index."""
+    global _ENDPOINT_CACHE_TS, _ENDPOINT_ETAG, _ENDPOINT_LASTMOD
+
+    # 1. Try local file first (fast, no network required)
+    endpoints = _load_local_bundle()
+
+    # 2. Fall back to network fetch if local file not available
+    if endpoints is None:
+        headers = {"Accept": "application/json"}
+        if _ENDPOINT_CACHE:
+            if _ENDPOINT_ETAG:
+                headers["If-None-Match"] = _ENDPOINT_ETAG
+            if _ENDPOINT_LASTMOD:
+                headers["If-Modified-Since"] = _ENDPOINT_LASTMOD
+        try:
+            resp = await get_client().get(
+                EPIC_ENDPOINT_BUNDLE_URL,
+                headers=headers,
+                follow_redirects=True,
+                timeout=20.0,
+            )
+            if resp.status_code == 304:
+                log.info("epic: endpoint bundle unchanged — keeping %d cached endpoints", len(_ENDPOINT_CACHE))
+                _ENDPOINT_CACHE_TS = time.monotonic()
+                return
+            resp.raise_for_status()
+            bundle = orjson.loads(resp.content)
+            endpoints = _parse_bundle_entries(bundle)
+            _ENDPOINT_ETAG = resp.headers.get("ETag")
+            _ENDPOINT_LASTMOD = resp.headers.get("Last-Modified")
+            log.info("epic: loaded %d endpoints from Epic network bundle", len(endpoints))
+        except Exception as exc:
+            log.warning("epic: failed to load endpoint directory from network — %s", exc)
+            endpoints = []
+
+    if endpoints:
+        _build_endpoint_index(endpoints)
+        _ENDPOINT_CACHE_TS = time.monotonic()
+    else:
+        # Back-date the timestamp so the cache goes stale again in
+        # _ENDPOINT_RETRY_AFTER seconds rather than on the very next call.
+        _ENDPOINT_CACHE_TS = time.monotonic() - _ENDPOINT_CACHE_TTL + _ENDPOINT_RETRY_AFTER
+
+
 async def get_endpoints(search: str = "") -> list[EpicEndpoint]:
     """
     Return Epic FHIR R4 endpoints matching the search string (hospital name).
@@ -174,108 +439,169 @@ async def get_endpoints(search: str = "") -> list[EpicEndpoint]:
 
     Results are cached in memory for 24 hours.
     """
-    global _ENDPOINT_CACHE, _ENDPOINT_CACHE_TS
-
-    # Refresh cache if stale
-    if time.time() - _ENDPOINT_CACHE_TS > _ENDPOINT_CACHE_TTL:
-        # 1. Try local file first (fast, no network required)
-        endpoints = _load_local_bundle()
-
-        # 2. Fall back to network fetch if local file not available
-        if endpoints is None:
-            try:
-                async with httpx.AsyncClient(timeout=20.0) as client:
-                    resp = await client.get(
-                        EPIC_ENDPOINT_BUNDLE_URL,
-                        headers={"Accept": "application/json"},
-                        follow_redirects=True,
-                    )
-                    resp.raise_for_status()
-                    bundle = resp.json()
-                endpoints = _parse_bundle_entries(bundle)
-                log.info("epic: loaded %d endpoints from Epic network bundle", len(endpoints))
-            except Exception as exc:
-                log.warning("epic: failed to load endpoint directory from network — %s", exc)
-                endpoints = []
-
-        if endpoints:
-            _ENDPOINT_CACHE = endpoints
-            _ENDPOINT_CACHE_TS = time.time()
-
-    # Filter by search term
-    query = search.strip().lower()
-    if not query:
-        return [EpicEndpoint(**e) for e in _ENDPOINT_CACHE[:50]]
+    # Refresh cache if stale; re-check under the lock so callers that queued
+    # behind the first refresh don't each reload the directory.
+    if _endpoint_cache_stale():
+        async with _ENDPOINT_LOCK:
+            if _endpoint_cache_stale():
+                await _refresh_endpoint_cache()
 
-    matches = [
-        EpicEndpoint(**e)
-        for e in _ENDPOINT_CACHE
-        if query in e["organization_name"].lower()
-        or query in e["fhir_base_url"].lower()
-    ]
-    return matches[:20]
+    return list(_search_endpoints(search.strip().lower(), _ENDPOINT_CACHE_GEN))
 
 
 # ── SMART configuration discovery ─────────────────────────────────────────────
+# Discovery documents rarely change, so results are cached per FHIR base URL
+# for 10 minutes.  Failures are cached for 30 s so a misconfigured hospital
+# can't turn every login click into another round-trip.  A per-URL lock
+# keeps concurrent logins on a cold cache down to a single fetch.  The base
+# URL comes from the user, so the cache is an LRU capped at _SMART_CACHE_MAX
+# and a lock is dropped once nobody holds or waits on it.
+#
+# A failure is cached as (exception type, message) and a fresh exception is
+# raised on every hit — sharing one instance would let concurrent requests
+# rewrite each other's __traceback__ / __context__.
+_SmartFailure = tuple[type[Exception], str]
+_SMART_CACHE: OrderedDict[str, tuple[float, SmartConfig | _SmartFailure]] = OrderedDict()
+_SMART_LOCKS: dict[str, asyncio.Lock] = {}
+_SMART_LOCK_USERS: dict[str, int] = {}   # holders + waiters per lock
+_SMART_TTL: float = 600.0
+_SMART_NEGATIVE_TTL: float = 30.0
+_SMART_CACHE_MAX: int = 256
+
+
+def _cached_smart_config(base: str) -> SmartConfig | _SmartFailure | None:
+    """Return the unexpired cache entry for *base* (config or cached failure)."""
+    hit = _SMART_CACHE.get(base)
+    if hit is None:
+        return None
+    ts, value = hit
+    ttl = _SMART_TTL if isinstance(value, SmartConfig) else _SMART_NEGATIVE_TTL
+    if time.monotonic() - ts >= ttl:
+        del _SMART_CACHE[base]
+        return None
+    _SMART_CACHE.move_to_end(base)
+    return value
+
+
+def _smart_failure_error(failure: _SmartFailure) -> Exception:
+    """Rebuild a cached discovery failure as a new exception instance."""
+    exc_type, message = failure
+    try:
+        return exc_type(message)
+    except Exception:
+        # Types like httpx.HTTPStatusError need more than a message
+        return ValueError(message)
+
 
 async def get_smart_config(fhir_base_url: str) -> SmartConfig:
     """
-    Fetch .well-known/smart-configuration from the FHIR server.
-    Falls back to metadata endpoint if smart-configuration is not found.
+    Return the SMART configuration for a FHIR server, served from a TTL cache.
+    Raises the (cached) discovery error if the server could not be resolved.
     """
     base = fhir_base_url.rstrip("/")
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        # Try SMART configuration endpoint first
+    value = _cached_smart_config(base)
+    if value is None:
+        lock = _SMART_LOCKS.setdefault(base, asyncio.Lock())
+        _SMART_LOCK_USERS[base] = _SMART_LOCK_USERS.get(base, 0) + 1
         try:
-            resp = await client.get(
-                f"{base}/.well-known/smart-configuration",
-                headers={"Accept": "application/json"},
-                follow_redirects=True,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            return SmartConfig(
-                authorization_endpoint=data["authorization_endpoint"],
-                token_endpoint=data["token_endpoint"],
-                scopes_supported=data.get("scopes_supported", []),
-            )
-        except Exception:
-            pass
+            async with lock:
+                value = _cached_smart_config(base)   # Another waiter may have filled it
+                if value is None:
+                    try:
+                        value = await _fetch_smart_config(base, fhir_base_url)
+                    except Exception as exc:
+                        value = (type(exc), str(exc))
+                    _SMART_CACHE[base] = (time.monotonic(), value)
+                    while len(_SMART_CACHE) > _SMART_CACHE_MAX:
+                        _SMART_CACHE.popitem(last=False)
+        finally:
+            users = _SMART_LOCK_USERS[base] - 1
+            if users:
+                _SMART_LOCK_USERS[base] = users
+            else:
+                del _SMART_LOCK_USERS[base]
+                _SMART_LOCKS.pop(base, None)
+
+    if not isinstance(value, SmartConfig):
+        raise _smart_failure_error(value)
+    return value
+
+
+async def _fetch_smart_config(base: str, fhir_base_url: str) -> SmartConfig:
+    """
+    Fetch .well-known/smart-configuration from the FHIR server.
+    Falls back to metadata endpoint if smart-configuration is not found.
 
-        # Fallback: FHIR metadata / CapabilityStatement
+    Transport failures (timeouts, refused connections) are not retried
+    against /metadata — it lives on the same host and would fail the same way.
+    """
+    client = get_client()
+
+    # Try SMART configuration endpoint first
+    try:
         resp = await client.get(
-            f"{base}/metadata",
+            f"{base}/.well-known/smart-configuration",
             headers={"Accept": "application/json"},
             follow_redirects=True,
+            timeout=15.0,
         )
         resp.raise_for_status()
-        meta = resp.json()
-        security = (
-            meta.get("rest", [{}])[0]
-            .get("security", {})
-            .get("extension", [])
+        data = orjson.loads(resp.content)
+        return SmartConfig(
+            authorization_endpoint=data["authorization_endpoint"],
+            token_endpoint=data["token_endpoint"],
+            scopes_supported=data.get("scopes_supported", []),
         )
-        auth_endpoint = token_endpoint = ""
-        for ext in security:
-            for sub in ext.get("extension", []):
-                if sub.get("url") == "authorize":
-                    auth_endpoint = sub.get("valueUri", "")
-                if sub.get("url") == "token":
-                    token_endpoint = sub.get("valueUri", "")
-
-        if not auth_endpoint or not token_endpoint:
-            raise ValueError(
-                f"Could not discover SMART endpoints for {fhir_base_url}. "
-                "This system may not support SMART on FHIR."
-            )
+    except httpx.TransportError:
+        raise
+    except (httpx.HTTPStatusError, orjson.JSONDecodeError, KeyError, TypeError, ValidationError):
+        pass   # Missing or malformed document — try the CapabilityStatement
 
-        return SmartConfig(
-            authorization_endpoint=auth_endpoint,
-            token_endpoint=token_endpoint,
+    # Fallback: FHIR metadata / CapabilityStatement
+    resp = await client.get(
+        f"{base}/metadata",
+        headers={"Accept": "application/json"},
+        follow_redirects=True,
+        timeout=15.0,
+    )
+    resp.raise_for_status()
+    meta = orjson.loads(resp.content)
+    security = (
+        meta.get("rest", [{}])[0]
+        .get("security", {})
+        .get("extension", [])
+    )
+    lookup = {
+        sub.get("url"): sub.get("valueUri", "")
+        for ext in security
+        for sub in ext.get("extension", [])
+    }
+    auth_endpoint = lookup.get("authorize", "")
+    token_endpoint = lookup.get("token", "")
+
+    if not auth_endpoint or not token_endpoint:
+        raise ValueError(
+            f"Could not discover SMART endpoints for {fhir_base_url}. "
+            "This system may not support SMART on FHIR."
         )
 
+    return SmartConfig(
+        authorization_endpoint=auth_endpoint,
+        token_endpoint=token_endpoint,
+    )
+
 
 # ── Authorization URL builder ─────────────────────────────────────────────────
+# The per-deployment part of the query string never changes, so it is
+# encoded once at import instead of on every login.
+_STATIC_AUTH_PARAMS = urlencode({
+    "response_type": "code",
+    "client_id": settings.epic_client_id,
+    "redirect_uri": settings.epic_redirect_uri,
+    "scope": SMART_SCOPES,
+    "code_challenge_method": "S256",
+})
+
 
 def build_auth_url(
     smart_config: SmartConfig,
@@ -290,17 +616,12 @@ def build_auth_url(
     The frontend stores the matching code_verifier in sessionStorage for
     use in the token exchange step.
     """
-    params = {
-        "response_type": "code",
-        "client_id": settings.epic_client_id,
-        "redirect_uri": settings.epic_redirect_uri,
-        "scope": SMART_SCOPES,
+    dynamic = urlencode({
         "state": state,
         "aud": fhir_base_url,          # Required by SMART — tells Epic which FHIR server
         "code_challenge": code_challenge,
-        "code_challenge_method": "S256",
-    }
-    return f"{smart_config.authorization_endpoint}?{urlencode(params)}"
+    })
+    return f"{smart_config.authorization_endpoint}?{_STATIC_AUTH_PARAMS}&{dynamic}"
 
 
 # ── Token exchange ────────────────────────────────────────────────────────────
@@ -311,23 +632,22 @@ async def exchange_code(
     code_verifier: str,
 ) -> TokenResponse:
     """Exchange an authorization code for access + refresh tokens."""
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.post(
-            token_endpoint,
-            data={
-                "grant_type": "authorization_code",
-                "code": code,
-                "redirect_uri": settings.epic_redirect_uri,
-                "client_id": settings.epic_client_id,
-                "code_verifier": code_verifier,
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
+    resp = await get_client().post(
+        token_endpoint,
+        data={
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": settings.epic_redirect_uri,
+            "client_id": settings.epic_client_id,
+            "code_verifier": code_verifier,
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    if not resp.is_success:
+        raise ValueError(
+            f"Token exchange failed ({resp.status_code}): {resp.text[:500]}"
         )
-        if not resp.is_success:
-            raise ValueError(
-                f"Token exchange failed ({resp.status_code}): {resp.text[:500]}"
-            )
-        return TokenResponse(**resp.json())
+    return TokenResponse(**orjson.loads(resp.content))
 
 
 async def refresh_access_token(
@@ -335,18 +655,17 @@ async def refresh_access_token(
     refresh_token: str,
 ) -> TokenResponse:
     """Use a refresh token to get a new access token."""
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.post(
-            token_endpoint,
-            data={
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-                "client_id": settings.epic_client_id,
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
-        resp.raise_for_status()
-        return TokenResponse(**resp.json())
+    resp = await get_client().post(
+        token_endpoint,
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": settings.epic_client_id,
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    resp.raise_for_status()
+    return TokenResponse(**orjson.loads(resp.content))
 
 
 # ── FHIR resource fetchers ────────────────────────────────────────────────────
@@ -362,17 +681,48 @@ async def _fhir_get(client: httpx.AsyncClient, url: str, token: str) -> dict:
         follow_redirects=True,
     )
     resp.raise_for_status()
-    return resp.json()
+    return orjson.loads(resp.content)
+
 
+# _elements lists — only the fields sync_fhir_data_to_db() reads, so Epic
+# returns trimmed resources (less JSON on the wire and fewer dicts to build).
+# "id" is listed explicitly: the bulk upsert keys on it, so it must not
+# depend on the server including mandatory elements by default.
+_MED_ELEMS = "id,status,medicationCodeableConcept,medicationReference,dosageInstruction"
+_COND_ELEMS = "id,clinicalStatus,code,onsetDateTime,recordedDate"
+_APPT_ELEMS = "id,status,start,minutesDuration,participant,reasonCode,serviceType,appointmentType"
+_ENC_ELEMS = "id,status,period,actualPeriod,participant,location,reasonCode,type"
+_ALLERGY_ELEMS = "id,clinicalStatus,code,reaction"
+_OBS_ELEMS = "id,status,category,code,effectiveDateTime,valueQuantity,valueString,valueCodeableConcept"
 
-async def _bundle_entries(client: httpx.AsyncClient, url: str, token: str) -> list[dict]:
-    """Fetch a FHIR searchset Bundle and return all resource entries."""
-    data = await _fhir_get(client, url, token)
-    entries = []
-    for entry in data.get("entry", []):
-        resource = entry.get("resource", {})
-        if resource:
-            entries.append(resource)
+# Encounters / Observations older than this are not pulled on sync.
+_HISTORY_WINDOW = timedelta(days=730)
+
+# Safety valve for servers that keep returning a "next" link.
+_MAX_BUNDLE_PAGES = 25
+
+
+async def _bundle_all(client: httpx.AsyncClient, url: str, token: str) -> list[dict]:
+    """
+    Fetch a FHIR searchset Bundle and return all resource entries, following
+    Bundle.link[relation=next] until the server stops paginating.
+    """
+    entries: list[dict] = []
+    next_url: Optional[str] = url
+    pages = 0
+    while next_url and pages < _MAX_BUNDLE_PAGES:
+        data = await _fhir_get(client, next_url, token)
+        pages += 1
+        for entry in data.get("entry", []):
+            resource = entry.get("resource", {})
+            if resource:
+                entries.append(resource)
+        next_url = next(
+            (link.get("url") for link in data.get("link", []) if link.get("relation") == "next"),
+            None,
+        )
+    if next_url:
+        log.warning("epic: stopped paging %s after %d pages", url, pages)
     return entries
 
 
@@ -384,35 +734,40 @@ async def fetch_patient_data(
     """
     Fetch all relevant patient FHIR resources in parallel.
     Returns a dict keyed by resource type.
+
+    Resource types fan out concurrently; within a type, pages are walked in
+    order over the shared keep-alive connection, so total latency is the
+    longest page chain rather than the sum.
     """
     base = fhir_base_url.rstrip("/")
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        import asyncio
-
-        async def safe_fetch(url):
-            try:
-                return await _bundle_entries(client, url, access_token)
-            except Exception as exc:
-                log.warning("epic: fetch failed for %s — %s", url, exc)
-                return []
+    client = get_client()
+    since = (datetime.now(timezone.utc) - _HISTORY_WINDOW).date().isoformat()
 
-        (
-            medications,
-            conditions,
-            appointments,
-            encounters,
-            allergies,
-            labs,
-            vitals,
-        ) = await asyncio.gather(
-            safe_fetch(f"{base}/MedicationRequest?patient={patient_id}&_count=100"),
-            safe_fetch(f"{base}/Condition?patient={patient_id}&category=problem-list-item&_count=100"),
-            safe_fetch(f"{base}/Appointment?patient={patient_id}&_count=50"),
-            safe_fetch(f"{base}/Encounter?patient={patient_id}&_count=50"),
-            safe_fetch(f"{base}/AllergyIntolerance?patient={patient_id}&_count=100"),
-            safe_fetch(f"{base}/Observation?patient={patient_id}&category=laboratory&_count=100"),
-            safe_fetch(f"{base}/Observation?patient={patient_id}&category=vital-signs&_count=50"),
-        )
+    async def safe_fetch(url):
+        try:
+            return await _bundle_all(client, url, access_token)
+        except Exception as exc:
+            log.warning("epic: fetch failed for %s — %s", url, exc)
+            return []
+
+    patient = f"patient={patient_id}&_count=200"
+    (
+        medications,
+        conditions,
+        appointments,
+        encounters,
+        allergies,
+        labs,
+        vitals,
+    ) = await asyncio.gather(
+        safe_fetch(f"{base}/MedicationRequest?{patient}&status=active,on-hold&_elements={_MED_ELEMS}"),
+        safe_fetch(f"{base}/Condition?{patient}&category=problem-list-item&_elements={_COND_ELEMS}"),
+        safe_fetch(f"{base}/Appointment?{patient}&_elements={_APPT_ELEMS}"),
+        safe_fetch(f"{base}/Encounter?{patient}&date=ge{since}&_elements={_ENC_ELEMS}"),
+        safe_fetch(f"{base}/AllergyIntolerance?{patient}&clinical-status=active&_elements={_ALLERGY_ELEMS}"),
+        safe_fetch(f"{base}/Observation?{patient}&category=laboratory&date=ge{since}&_elements={_OBS_ELEMS}"),
+        safe_fetch(f"{base}/Observation?{patient}&category=vital-signs&date=ge{since}&_elements={_OBS_ELEMS}"),
+    )
 
     return {
         "medications": medications,
@@ -426,17 +781,47 @@ async def fetch_patient_data(
 
 
 # ── FHIR → WellBridge data mapping ────────────────────────────────────────────
+def _first(node, *path):
+    """
+    Walk *path* (dict keys and list indexes) into a FHIR resource.
+
+    Returns None as soon as an element is missing, an index is out of range
+    or a node has the wrong shape, so ``_first(r, "code", "coding", 0,
+    "display")`` replaces ``r.get("code", {}).get("coding", [{}])[0].get(...)``
+    without the IndexError on an empty list.
+    """
+    for step in path:
+        if isinstance(step, int):
+            if not isinstance(node, list) or not -len(node) <= step < len(node):
+                return None
+            node = node[step]
+        else:
+            if not isinstance(node, dict):
+                return None
+            node = node.get(step)
+        if node is None:
+            return None
+    return node
+
+
+# Status code sets the sync filters on.
+_ACTIVE_MED_STATUSES = frozenset({"active", "intended", "on-hold"})
+_ACTIVE_COND_STATUSES = frozenset({"active", "recurrence", "relapse"})
+_DONE_ENC_STATUSES = frozenset({"finished", "completed"})
+_CANCELED_APPT = frozenset({"cancelled", "noshow"})
+
 
 def _extract_medication_name(med_resource: dict) -> Optional[str]:
     """Extract medication display name from a MedicationRequest resource."""
-    # medicationCodeableConcept.text is the most readable
-    concept = med_resource.get("medicationCodeableConcept", {})
+    # medicationCodeableConcept.text is the most readable, then the first
+    # coding with a display, then the referenced Medication's display
+    concept = med_resource.get("medicationCodeableConcept") or {}
     if concept.get("text"):
         return concept["text"]
-    for coding in concept.get("coding", []):
+    for coding in concept.get("coding") or []:
         if coding.get("display"):
             return coding["display"]
-    return med_resource.get("medicationReference", {}).get("display")
+    return _first(med_resource, "medicationReference", "display")
 
 
 def _extract_dosage(med_resource: dict) -> tuple[Optional[str], Optional[str], Optional[str]]:
@@ -445,9 +830,9 @@ def _extract_dosage(med_resource: dict) -> tuple[Optional[str], Optional[str], O
     if not dosages:
         return None, None, None
     d = dosages[0]
-    dose = d.get("doseAndRate", [{}])[0].get("doseQuantity", {})
+    dose = _first(d, "doseAndRate", 0, "doseQuantity") or {}
     dose_str = f"{dose.get('value', '')} {dose.get('unit', '')}".strip() or None
-    freq = d.get("timing", {}).get("repeat", {})
+    freq = _first(d, "timing", "repeat") or {}
     freq_str = None
     if freq.get("frequency") and freq.get("period") and freq.get("periodUnit"):
         freq_str = f"{freq['frequency']}x per {freq['period']} {freq['periodUnit']}"
@@ -455,40 +840,127 @@ def _extract_dosage(med_resource: dict) -> tuple[Optional[str], Optional[str], O
     return dose_str, freq_str, instructions
 
 
-def _fhir_date_to_iso(date_str: Optional[str]) -> Optional[str]:
-    """Normalize a FHIR date/dateTime to ISO 8601 date string."""
-    if not date_str:
-        return None
-    return date_str[:10]  # YYYY-MM-DD
+def _external_id(resource: dict, resource_type: str) -> Optional[str]:
+    """FHIR-style reference ("Condition/abc") used as the upsert key for a synced row."""
+    rid = resource.get("id")
+    return f"{resource_type}/{rid}" if rid else None
 
 
-def sync_fhir_data_to_db(
-    fhir_data: dict,
+def _record_row(
     tenant_id: str,
     user_id: str,
-    db,
+    external_id: Optional[str],
+    record_type: str,
+    provider_name: Optional[str],
+    note_date: str,
+    content: str,
+    facility_name: Optional[str] = None,
 ) -> dict:
     """
-    Upsert FHIR resources into WellBridge's patient_records and appointments tables.
+    Build a patient_records row.  Every row carries the same keys — PostgREST
+    bulk upserts take their column list from the payload.
+    """
+    return {
+        "tenant_id": tenant_id,
+        "patient_user_id": user_id,
+        "external_id": external_id,
+        "record_type": record_type,
+        "provider_name": provider_name,
+        "facility_name": facility_name,
+        "note_date": note_date,
+        "content": content,
+    }
 
-    This is a sync operation (not async) — called from a sync context or
-    wrapped in asyncio.to_thread if needed.
 
-    Returns a summary of what was inserted/updated.
+def _dedupe_by_external_id(rows: list[dict]) -> list[dict]:
     """
-    summary = {
-        "medications": 0,
-        "conditions": 0,
-        "appointments": 0,
-        "encounters": 0,
-        "allergies": 0,
-    }
+    Drop repeated external_ids (last wins) — Postgres rejects an ON CONFLICT
+    upsert that touches the same key twice.  Rows without an id are kept.
+    """
+    keyed: dict[str, dict] = {}
+    unkeyed: list[dict] = []
+    for row in rows:
+        if row["external_id"]:
+            keyed[row["external_id"]] = row
+        else:
+            unkeyed.append(row)
+    return list(keyed.values()) + unkeyed
+
+
+_RECORDS_CONFLICT = "tenant_id,patient_user_id,record_type,external_id"
+_APPOINTMENTS_CONFLICT = "tenant_id,patient_user_id,external_id"
+
+
+async def _upsert_rows(db, table: str, rows: list[dict], on_conflict: str) -> bool:
+    """
+    Bulk-upsert *rows* into *table* on a worker thread (the Supabase client is
+    blocking).  Returns True if rows were written, False if empty or failed.
+    """
+    if not rows:
+        return False
+    payload = _dedupe_by_external_id(rows)
+    try:
+        await asyncio.to_thread(
+            lambda: db.table(table).upsert(payload, on_conflict=on_conflict).execute()
+        )
+        return True
+    except Exception as exc:
+        log.warning("epic sync: %s upsert failed — %s", table, exc)
+        return False
+
+
+# Rows written before migration 0022 carry no FHIR id, so they never conflict
+# with the keyed upsert.  Before writing, the sync deletes the pre-0022 rows
+# that a row in this batch replaces.  The content matches exactly because the
+# formatters haven't changed.  Prescriptions also match on the
+# 'medication:<name>' key that migration 0023 backfilled onto old rows.  Once
+# a patient has re-synced, nothing matches any more.
+_LEGACY_RX_FILTER = "external_id.is.null,external_id.not.like.MedicationRequest/*"
+_LEGACY_DELETE_CHUNK = 50   # values per IN (...) — keeps the DELETE URL short
 
-    today = datetime.now(timezone.utc).date().isoformat()
 
-    # ── Medications ──────────────────────────────────────────────────────────
-    for med in fhir_data.get("medications", []):
-        if med.get("status") not in ("active", "intended", "on-hold"):
+async def _delete_legacy_rows(
+    db,
+    table: str,
+    tenant_id: str,
+    user_id: str,
+    legacy_filter: str,
+    column: str,
+    values: list[str],
+    **eq: str,
+) -> None:
+    """
+    Delete pre-0022 rows of *table* matching *legacy_filter* (a PostgREST
+    ``or`` expression) whose *column* is one of *values*.  Best effort: a
+    failure is logged and the upsert still runs.
+    """
+    values = list(dict.fromkeys(v for v in values if v))
+    for i in range(0, len(values), _LEGACY_DELETE_CHUNK):
+        chunk = values[i:i + _LEGACY_DELETE_CHUNK]
+        query = (
+            db.table(table).delete()
+            .eq("tenant_id", tenant_id)
+            .eq("patient_user_id", user_id)
+            .or_(legacy_filter)
+        )
+        for col, val in eq.items():
+            query = query.eq(col, val)
+        try:
+            await asyncio.to_thread(query.in_(column, chunk).execute)
+        except Exception as exc:
+            log.warning("epic sync: legacy %s cleanup failed — %s", table, exc)
+            return
+
+
+# ── Extraction stage: FHIR resources → table rows ────────────────────────────
+# One single-pass builder per resource type.  Each filters to the resources
+# worth storing and emits finished rows, so the write stage below is just a
+# bulk upsert per table.
+
+def _medication_rows(meds: list[dict], tenant_id: str, user_id: str, today: str) -> list[dict]:
+    rows = []
+    for med in meds:
+        if med.get("status") not in _ACTIVE_MED_STATUSES:
             continue
         name = _extract_medication_name(med)
         if not name:
@@ -502,109 +974,103 @@ def sync_fhir_data_to_db(
         if instructions:
             content_parts.append(f"Instructions: {instructions}")
 
-        try:
-            # Upsert: delete existing active prescription with same name, then insert
-            db.table("patient_records").delete().eq(
-                "tenant_id", tenant_id
-            ).eq(
-                "patient_user_id", user_id
-            ).eq("record_type", "prescription").ilike(
-                "provider_name", f"%{name}%"
-            ).execute()
-
-            db.table("patient_records").insert({
-                "tenant_id": tenant_id,
-                "patient_user_id": user_id,
-                "record_type": "prescription",
-                "provider_name": name,
-                "note_date": today,
-                "content": "\n".join(content_parts),
-            }).execute()
-            summary["medications"] += 1
-        except Exception as exc:
-            log.warning("epic sync: medication insert failed — %s", exc)
-
-    # ── Conditions ───────────────────────────────────────────────────────────
-    for cond in fhir_data.get("conditions", []):
-        if cond.get("clinicalStatus", {}).get("coding", [{}])[0].get("code") not in (
-            "active", "recurrence", "relapse"
-        ):
+        rows.append(_record_row(
+            tenant_id, user_id,
+            external_id=_external_id(med, "MedicationRequest"),
+            record_type="prescription",
+            provider_name=name,
+            note_date=today,
+            content="\n".join(content_parts),
+        ))
+    return rows
+
+
+def _condition_rows(conds: list[dict], tenant_id: str, user_id: str, today: str) -> list[dict]:
+    rows = []
+    for cond in conds:
+        if _first(cond, "clinicalStatus", "coding", 0, "code") not in _ACTIVE_COND_STATUSES:
             continue
         name = (
-            cond.get("code", {}).get("text")
-            or cond.get("code", {}).get("coding", [{}])[0].get("display")
+            _first(cond, "code", "text")
+            or _first(cond, "code", "coding", 0, "display")
         )
         if not name:
             continue
-        onset = _fhir_date_to_iso(
-            cond.get("onsetDateTime") or cond.get("recordedDate")
-        ) or today
-
-        try:
-            db.table("patient_records").insert({
-                "tenant_id": tenant_id,
-                "patient_user_id": user_id,
-                "record_type": "clinical_note",
-                "provider_name": "Epic — Active Condition",
-                "facility_name": "MyChart Sync",
-                "note_date": onset,
-                "content": f"Active condition: {name}",
-            }).execute()
-            summary["conditions"] += 1
-        except Exception as exc:
-            log.warning("epic sync: condition insert failed — %s", exc)
+        onset = cond.get("onsetDateTime") or cond.get("recordedDate")
+        onset = onset[:10] if onset else today  # FHIR dateTime → YYYY-MM-DD
+
+        rows.append(_record_row(
+            tenant_id, user_id,
+            external_id=_external_id(cond, "Condition"),
+            record_type="clinical_note",
+            provider_name="Epic — Active Condition",
+            facility_name="MyChart Sync",
+            note_date=onset,
+            content=f"Active condition: {name}",
+        ))
+    return rows
+
+
+def _pick_practitioner(participants: list[dict]) -> str | None:
+    """
+    Display name of the first practitioner participant on an Appointment.
 
-    # ── Appointments ─────────────────────────────────────────────────────────
-    for appt in fhir_data.get("appointments", []):
-        if appt.get("status") in ("cancelled", "noshow"):
+    Actors with no type are accepted unless their reference points at a
+    Patient — Epic often omits the type on the practitioner actor.
+    """
+    for p in participants:
+        actor = p.get("actor") or {}
+        actor_type = (actor.get("type") or "").lower()
+        if actor_type == "practitioner":
+            return actor.get("display")
+        if not actor_type and not (actor.get("reference") or "").startswith("Patient/"):
+            return actor.get("display")
+    return None
+
+
+def _appointment_rows(appts: list[dict], tenant_id: str, user_id: str) -> list[dict]:
+    rows = []
+    for appt in appts:
+        if appt.get("status") in _CANCELED_APPT:
             continue
         start = appt.get("start")
         if not start:
             continue
-        participant = next(
-            (
-                p.get("actor", {}).get("display")
-                for p in appt.get("participant", [])
-                if p.get("actor", {}).get("type", "").lower() in ("practitioner", "")
-                and "Patient" not in p.get("actor", {}).get("type", "Patient")
-            ),
-            None,
-        )
+        participant = _pick_practitioner(appt.get("participant", []))
         reason = (
-            appt.get("reasonCode", [{}])[0].get("text")
-            or appt.get("serviceType", [{}])[0].get("text")
-            or appt.get("appointmentType", {}).get("text")
+            _first(appt, "reasonCode", 0, "text")
+            or _first(appt, "serviceType", 0, "text")
+            or _first(appt, "appointmentType", "text")
             or "Visit"
         )
 
-        try:
-            db.table("appointments").insert({
-                "tenant_id": tenant_id,
-                "patient_user_id": user_id,
-                "provider_name": participant,
-                "appointment_date": start,
-                "duration_minutes": appt.get("minutesDuration", 30),
-                "notes": reason,
-                "source": "google_calendar",  # reuse existing source type
-            }).execute()
-            summary["appointments"] += 1
-        except Exception as exc:
-            log.warning("epic sync: appointment insert failed — %s", exc)
-
-    # ── Encounters (visit history as clinical notes) ──────────────────────────
-    for enc in fhir_data.get("encounters", []):
-        if enc.get("status") not in ("finished", "completed"):
+        rows.append({
+            "tenant_id": tenant_id,
+            "patient_user_id": user_id,
+            "external_id": _external_id(appt, "Appointment"),
+            "provider_name": participant,
+            "appointment_date": start,
+            "duration_minutes": appt.get("minutesDuration", 30),
+            "notes": reason,
+            "source": "google_calendar",  # reuse existing source type
+        })
+    return rows
+
+
+def _encounter_rows(encs: list[dict], tenant_id: str, user_id: str) -> list[dict]:
+    rows = []
+    for enc in encs:
+        if enc.get("status") not in _DONE_ENC_STATUSES:
             continue
-        enc_date = _fhir_date_to_iso(
-            enc.get("period", {}).get("start") or enc.get("actualPeriod", {}).get("start")
-        )
+        enc_date = _first(enc, "period", "start") or _first(enc, "actualPeriod", "start")
         if not enc_date:
             continue
-        provider = enc.get("participant", [{}])[0].get("individual", {}).get("display")
-        location = enc.get("location", [{}])[0].get("location", {}).get("display")
+        enc_date = enc_date[:10]  # FHIR dateTime → YYYY-MM-DD
+        provider = _first(enc, "participant", 0, "individual", "display")
+        location = _first(enc, "location", 0, "location", "display")
         reason = (
-            enc.get("reasonCode", [{}])[0].get("text")
-            or enc.get("type", [{}])[0].get("text")
+            _first(enc, "reasonCode", 0, "text")
+            or _first(enc, "type", 0, "text")
             or "Outpatient Visit"
         )
         content = f"Visit: {reason}"
@@ -613,50 +1079,110 @@ def sync_fhir_data_to_db(
         if location:
             content += f"\nLocation: {location}"
 
-        try:
-            db.table("patient_records").insert({
-                "tenant_id": tenant_id,
-                "patient_user_id": user_id,
-                "record_type": "clinical_note",
-                "provider_name": provider or "Epic — Visit",
-                "facility_name": location,
-                "note_date": enc_date,
-                "content": content,
-            }).execute()
-            summary["encounters"] += 1
-        except Exception as exc:
-            log.warning("epic sync: encounter insert failed — %s", exc)
-
-    # ── Allergies ────────────────────────────────────────────────────────────
-    for allergy in fhir_data.get("allergies", []):
-        if allergy.get("clinicalStatus", {}).get("coding", [{}])[0].get("code") != "active":
+        rows.append(_record_row(
+            tenant_id, user_id,
+            external_id=_external_id(enc, "Encounter"),
+            record_type="clinical_note",
+            provider_name=provider or "Epic — Visit",
+            facility_name=location,
+            note_date=enc_date,
+            content=content,
+        ))
+    return rows
+
+
+def _allergy_rows(allergies: list[dict], tenant_id: str, user_id: str, today: str) -> list[dict]:
+    rows = []
+    for allergy in allergies:
+        if _first(allergy, "clinicalStatus", "coding", 0, "code") != "active":
             continue
         substance = (
-            allergy.get("code", {}).get("text")
-            or allergy.get("code", {}).get("coding", [{}])[0].get("display")
+            _first(allergy, "code", "text")
+            or _first(allergy, "code", "coding", 0, "display")
         )
         if not substance:
             continue
-        reactions = [
-            r.get("manifestation", [{}])[0].get("text", "")
-            for r in allergy.get("reaction", [])
-        ]
+        reactions = (
+            _first(r, "manifestation", 0, "text") for r in allergy.get("reaction") or []
+        )
         reaction_str = ", ".join(r for r in reactions if r)
         content = f"Allergy: {substance}"
         if reaction_str:
             content += f"\nReaction: {reaction_str}"
 
-        try:
-            db.table("patient_records").insert({
-                "tenant_id": tenant_id,
-                "patient_user_id": user_id,
-                "record_type": "clinical_note",
-                "provider_name": "Epic — Allergy",
-                "note_date": today,
-                "content": content,
-            }).execute()
-            summary["allergies"] += 1
-        except Exception as exc:
-            log.warning("epic sync: allergy insert failed — %s", exc)
+        rows.append(_record_row(
+            tenant_id, user_id,
+            external_id=_external_id(allergy, "AllergyIntolerance"),
+            record_type="clinical_note",
+            provider_name="Epic — Allergy",
+            note_date=today,
+            content=content,
+        ))
+    return rows
+
+
+async def sync_fhir_data_to_db(
+    fhir_data: dict,
+    tenant_id: str,
+    user_id: str,
+    db,
+) -> dict:
+    """
+    Upsert FHIR resources into WellBridge's patient_records and appointments tables.
+
+    Rows are keyed by the FHIR resource id (external_id), so a re-sync
+    updates in place.  All record types go out in one bulk upsert per table
+    instead of one round-trip per resource; the two tables are written
+    concurrently.
+
+    Returns a summary of what was inserted/updated.
+    """
+    summary = {
+        "medications": 0,
+        "conditions": 0,
+        "appointments": 0,
+        "encounters": 0,
+        "allergies": 0,
+    }
+
+    today = datetime.now(timezone.utc).date().isoformat()
+    record_rows: dict[str, list[dict]] = {
+        "medications": _medication_rows(fhir_data.get("medications", []), tenant_id, user_id, today),
+        "conditions":  _condition_rows(fhir_data.get("conditions", []), tenant_id, user_id, today),
+        "encounters":  _encounter_rows(fhir_data.get("encounters", []), tenant_id, user_id),
+        "allergies":   _allergy_rows(fhir_data.get("allergies", []), tenant_id, user_id, today),
+    }
+    appt_rows = _appointment_rows(fhir_data.get("appointments", []), tenant_id, user_id)
+
+    # ── Drop pre-0022 copies of these rows so the upsert doesn't duplicate them
+    all_records = [row for rows in record_rows.values() for row in rows]
+    await asyncio.gather(
+        _delete_legacy_rows(
+            db, "patient_records", tenant_id, user_id, _LEGACY_RX_FILTER,
+            "content", [r["content"] for r in record_rows["medications"]],
+            record_type="prescription",
+        ),
+        _delete_legacy_rows(
+            db, "patient_records", tenant_id, user_id, "external_id.is.null",
+            "content", [r["content"] for r in all_records if r["record_type"] == "clinical_note"],
+            record_type="clinical_note",
+        ),
+        _delete_legacy_rows(
+            db, "appointments", tenant_id, user_id, "external_id.is.null",
+            "appointment_date", [r["appointment_date"] for r in appt_rows],
+            source="google_calendar",
+        ),
+    )
+
+    # ── Bulk writes: one upsert per table, both in flight at once ────────────
+    records_ok, appts_ok = await asyncio.gather(
+        _upsert_rows(db, "patient_records", all_records, _RECORDS_CONFLICT),
+        _upsert_rows(db, "appointments", appt_rows, _APPOINTMENTS_CONFLICT),
+    )
+    if records_ok:
+        for key, rows in record_rows.items():
+            summary[key] = len(rows)
+    if appts_ok:
+        summary["appointments"] = len(appt_rows)
 
     return summary
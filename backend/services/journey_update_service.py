@@ -8,14 +8,18 @@ the database, with deduplication so the same medication or appointment is
 never listed twice.
 
 Deduplication rules:
-  Medications:   keyed by lowercase medication name within a patient's records.
-                 If a prescription record already exists for that medication,
-                 update the content (newer upload may have an updated dose).
-                 If not, insert a new prescription record.
+  Medications:   keyed by lowercase medication name within a patient's records
+                 (the medication_key column).  All prescriptions from a note are
+                 written in one bulk upsert: an existing record for that
+                 medication — uploaded or Epic-synced — gets the new content
+                 (newer upload may have an updated dose); otherwise a new
+                 prescription record is added, keyed by external_id
+                 "medication:<name>".
 
   Appointments:  keyed by (provider_name + appointment_date calendar day) for
-                 the patient. If an appointment already exists on that day with
-                 the same provider, skip it. If not, insert.
+                 the patient. Existing appointments across the whole date span
+                 are fetched in one query; if one already exists on that day
+                 with the same provider, skip it. The rest go in one insert.
 
   Referrals:     stored as clinical_note records so the patient can see them in
                  the Documents filter. No dedup — each referral is distinct.
@@ -28,16 +32,74 @@ So inserting correctly typed records here is all that's needed for the Journey
 to reflect the upload.
 """
 
+import asyncio
 import logging
+import re
 from datetime import date, datetime
+from functools import lru_cache
 from typing import Any
 
+import asyncpg
+from dateutil import parser as dateutil_parser
+from dateutil.relativedelta import relativedelta
+from supabase import Client
+
 from services.note_analysis_service import NoteAnalysisResult, Prescription, FollowUpAppointment
 from middleware.tenant import TenantContext
+from services.db_pool import get_pool
 from services.supabase_client import get_admin_client
 
 log = logging.getLogger("wellbridge.journey")
 
+# Conflict target for note-derived prescriptions — matches idx_records_external_id
+_PRESCRIPTION_CONFLICT = "tenant_id,patient_user_id,record_type,external_id"
+
+# Relative follow-up timeframes: "in 3 months", "in 2 weeks", "in 10 days"
+_RELATIVE_TIMEFRAME_RE = re.compile(r"in\s+(\d+)\s+(day|week|month)s?", re.IGNORECASE)
+
+# Date shapes tried with strptime before falling back to dateutil
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%B %d, %Y", "%b %d, %Y")
+
+# Direct-Postgres equivalents of the two writes, used when the asyncpg pool is
+# configured.  The prescription upsert sends every row as parallel arrays in a
+# single statement; RETURNING (xmax = 0) is true for fresh inserts, false for
+# rows that hit ON CONFLICT, which gives the inserted/updated split for free.
+_UPSERT_PRESCRIPTIONS_SQL = """
+    INSERT INTO patient_records
+        (tenant_id, patient_user_id, record_type, external_id, provider_name, note_date, content)
+    SELECT $1::uuid, $2::text, 'prescription'::record_type, r.external_id, r.provider_name, $3::date, r.content
+    FROM unnest($4::text[], $5::text[], $6::text[]) AS r(external_id, provider_name, content)
+    ON CONFLICT (tenant_id, patient_user_id, record_type, external_id) DO UPDATE
+        SET provider_name = EXCLUDED.provider_name,
+            note_date     = EXCLUDED.note_date,
+            content       = EXCLUDED.content
+    RETURNING (xmax = 0) AS inserted
+"""
+
+_SELECT_PRESCRIPTIONS_SQL = """
+    SELECT external_id, medication_key
+    FROM patient_records
+    WHERE tenant_id = $1
+      AND patient_user_id = $2
+      AND record_type = 'prescription'
+      AND medication_key = ANY($3::text[])
+"""
+
+_SELECT_APPOINTMENTS_SQL = """
+    SELECT provider_name, appointment_date::date AS day
+    FROM appointments
+    WHERE tenant_id = $1
+      AND patient_user_id = $2
+      AND appointment_date >= $3::date
+      AND appointment_date <  $4::date + 1
+"""
+
+_INSERT_APPOINTMENT_SQL = """
+    INSERT INTO appointments
+        (tenant_id, patient_user_id, provider_name, facility_name, appointment_date, notes, source)
+    VALUES ($1, $2, $3, $4, $5::text::timestamptz, $6, $7)
+"""
+
 
 async def update_journey_from_analysis(
     analysis: NoteAnalysisResult,
@@ -46,128 +108,342 @@ async def update_journey_from_analysis(
     """
     Upsert prescriptions and appointments extracted from a clinical note.
 
+    With DATABASE_URL set, both sections run in a single Postgres transaction
+    on a pooled asyncpg connection.  Otherwise they go through the Supabase
+    admin client and, touching different tables, run concurrently (each
+    synchronous .execute() pushed to a worker thread to keep the event loop
+    free).
+
     Returns a summary dict with counts of inserted/updated items.
     Raises on unexpected errors — caller should catch and treat as non-blocking.
     """
-    # Admin client bypasses RLS — security enforced by explicit tenant/user
-    # filters already present on every query in this function.
-    db = get_admin_client()
-    today = date.today().isoformat()
-
-    meds_inserted = 0
-    meds_updated = 0
-    appts_inserted = 0
-    appts_skipped = 0
+    # Short notes often yield nothing to write — skip the DB entirely
+    if not analysis.prescriptions and not analysis.follow_up_appointments:
+        return {
+            "medications_inserted": 0,
+            "medications_updated": 0,
+            "appointments_inserted": 0,
+            "appointments_skipped": 0,
+        }
+
+    today = date.today()
+    med_rows = _prescription_rows(analysis, ctx, today.isoformat())
+    parsed, unparseable = _parse_appointments(analysis)
+
+    # Both paths bypass RLS — security enforced by explicit tenant/user
+    # filters present on every query below.
+    pool = await get_pool()
+    if pool is not None:
+        # One connection, one transaction: a single commit for the whole
+        # update, and a failure part-way leaves no half-applied Journey.
+        # Errors propagate (rolled back) to the caller.
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                meds = await _pg_upsert_medications(conn, med_rows, ctx, today)
+                appts = await _pg_insert_appointments(conn, parsed, ctx)
+    else:
+        db = get_admin_client()
+        meds, appts = await asyncio.gather(
+            _upsert_medications(db, med_rows, ctx),
+            _insert_appointments(db, parsed, ctx),
+        )
+
+    appts["appointments_skipped"] += unparseable
+    return {**meds, **appts}
+
+
+# ── Medications (prescriptions) ────────────────────────────────────────────────
+
+def _prescription_rows(
+    analysis: NoteAnalysisResult,
+    ctx: TenantContext,
+    today: str,
+) -> dict[str, dict]:
+    """
+    Build patient_records rows keyed by medication key.
 
-    # ── Medications (prescriptions) ────────────────────────────────────────────
+    One row per distinct medication; a later mention in the same note wins,
+    as it did when each one was written in turn.
+    """
+    med_rows: dict[str, dict] = {}
     for rx in analysis.prescriptions:
         if not rx.medication:
             continue
-
         med_name = rx.medication.strip()
-        content = _format_prescription_content(rx)
+        key = _medication_key(med_name)
+        med_rows[key] = {
+            "tenant_id": ctx.tenant_id,
+            "patient_user_id": ctx.user_id,
+            "external_id": key,
+            "record_type": "prescription",
+            "provider_name": med_name,   # medication name in provider_name for Journey title
+            "note_date": today,
+            "content": _format_prescription_content(rx),
+        }
+    return med_rows
+
+
+def _adopt_existing_keys(med_rows: dict[str, dict], existing: list) -> int:
+    """
+    Point each row at the prescription it should update, if one exists.
 
+    *existing* holds (external_id, medication_key) for the patient's current
+    prescriptions with a matching name.  A note-derived row for the medication
+    is preferred; otherwise an Epic-synced one is adopted so the medication
+    isn't listed twice.  Rows without an external_id can't be upsert targets
+    and are ignored.  Returns the number of rows that will update, not insert.
+    """
+    by_name: dict[str, set[str]] = {}
+    for r in existing:
+        if r["external_id"]:
+            by_name.setdefault(r["medication_key"], set()).add(r["external_id"])
+
+    matched = 0
+    for key, row in med_rows.items():
+        ids = by_name.get(row["provider_name"].lower())
+        if not ids:
+            continue
+        matched += 1
+        if key not in ids:
+            row["external_id"] = min(ids)
+    return matched
+
+
+async def _upsert_medications(
+    db: Client,
+    med_rows: dict[str, dict],
+    ctx: TenantContext,
+) -> dict[str, int]:
+    meds_inserted = 0
+    meds_updated = 0
+
+    if med_rows:
         try:
-            # Check if a prescription record already exists for this medication
-            existing = (
+            # One lookup for existing prescriptions, one bulk upsert —
+            # instead of a SELECT + UPDATE/INSERT per medication
+            existing = await asyncio.to_thread(
                 db.table("patient_records")
-                .select("id")
+                .select("external_id, medication_key")
                 .eq("tenant_id", ctx.tenant_id)
                 .eq("patient_user_id", ctx.user_id)
                 .eq("record_type", "prescription")
-                .ilike("provider_name", f"%{med_name}%")
-                .limit(1)
-                .execute()
+                .in_("medication_key", [r["provider_name"].lower() for r in med_rows.values()])
+                .execute
+            )
+            meds_updated = _adopt_existing_keys(med_rows, existing.data or [])
+            await asyncio.to_thread(
+                db.table("patient_records").upsert(
+                    list(med_rows.values()),
+                    on_conflict=_PRESCRIPTION_CONFLICT,
+                    ignore_duplicates=False,   # newer upload supersedes old dose/frequency
+                ).execute
             )
+            meds_inserted = len(med_rows) - meds_updated
+            log.info(
+                "journey: upserted %d prescription record(s) (%d new, %d updated)",
+                len(med_rows), meds_inserted, meds_updated,
+            )
+        except Exception as exc:
+            log.warning("journey: failed to upsert %d prescription(s) — %s", len(med_rows), exc)
 
-            if existing.data:
-                # Update — newer upload supersedes old dose/frequency
-                record_id = existing.data[0]["id"]
-                db.table("patient_records").update({
-                    "content": content,
-                    "note_date": today,
-                }).eq("id", record_id).execute()
-                log.info("journey: updated prescription record for '%s' (id=%s)", med_name, record_id)
-                meds_updated += 1
-            else:
-                # Insert new prescription record
-                db.table("patient_records").insert({
-                    "tenant_id": ctx.tenant_id,
-                    "patient_user_id": ctx.user_id,
-                    "record_type": "prescription",
-                    "provider_name": med_name,   # medication name in provider_name for Journey title
-                    "note_date": today,
-                    "content": content,
-                }).execute()
-                log.info("journey: inserted prescription record for '%s'", med_name)
-                meds_inserted += 1
+    return {
+        "medications_inserted": meds_inserted,
+        "medications_updated": meds_updated,
+    }
 
-        except Exception as exc:
-            log.warning("journey: failed to upsert prescription '%s' — %s", med_name, exc)
 
-    # ── Appointments ───────────────────────────────────────────────────────────
+async def _pg_upsert_medications(
+    conn: asyncpg.Connection,
+    med_rows: dict[str, dict],
+    ctx: TenantContext,
+    today: date,
+) -> dict[str, int]:
+    if not med_rows:
+        return {"medications_inserted": 0, "medications_updated": 0}
+
+    existing = await conn.fetch(
+        _SELECT_PRESCRIPTIONS_SQL,
+        ctx.tenant_id, ctx.user_id,
+        [r["provider_name"].lower() for r in med_rows.values()],
+    )
+    _adopt_existing_keys(med_rows, existing)
+
+    rows = med_rows.values()
+    result = await conn.fetch(
+        _UPSERT_PRESCRIPTIONS_SQL,
+        ctx.tenant_id, ctx.user_id, today,
+        [r["external_id"] for r in rows],
+        [r["provider_name"] for r in rows],
+        [r["content"] for r in rows],
+    )
+    meds_inserted = sum(1 for r in result if r["inserted"])
+    meds_updated = len(result) - meds_inserted
+    log.info(
+        "journey: upserted %d prescription record(s) (%d new, %d updated)",
+        len(result), meds_inserted, meds_updated,
+    )
+    return {
+        "medications_inserted": meds_inserted,
+        "medications_updated": meds_updated,
+    }
+
+
+# ── Appointments ───────────────────────────────────────────────────────────────
+
+def _parse_appointments(
+    analysis: NoteAnalysisResult,
+) -> tuple[list[tuple[FollowUpAppointment, str, str]], int]:
+    """
+    Parse each follow-up's date up front so the existing-appointment check can
+    be a single range query instead of one SELECT per appointment.
+
+    Returns ([(appointment, iso_date, provider)], count_without_a_date).
+    """
+    parsed: list[tuple[FollowUpAppointment, str, str]] = []
+    skipped = 0
     for appt in analysis.follow_up_appointments:
         appt_date = _parse_appointment_date(appt.date_or_timeframe)
         if not appt_date:
             # Can't store without a parseable date — skip
             log.debug("journey: skipping appointment with no parseable date: %s", appt)
-            appts_skipped += 1
+            skipped += 1
             continue
+        parsed.append((appt, appt_date, (appt.provider_name or appt.specialty or "").strip()))
+    return parsed, skipped
+
 
-        provider = (appt.provider_name or appt.specialty or "").strip()
+def _new_appointment_rows(
+    parsed: list[tuple[FollowUpAppointment, str, str]],
+    booked: dict[str, list[str]],
+    ctx: TenantContext,
+) -> tuple[list[dict], int]:
+    """
+    Drop appointments already booked and build rows for the rest.
 
+    booked maps calendar day → lowercased provider names already on that day;
+    it is extended as rows are accepted so in-batch repeats are caught too.
+    Returns (rows_to_insert, skipped_count).
+    """
+    to_insert = []
+    skipped = 0
+    for appt, appt_date, provider in parsed:
+        # Same provider + same calendar day counts as a duplicate
+        # (substring match, as before); no provider matches any
+        # appointment that day.
+        provider_lower = provider.lower()
+        day = booked.setdefault(appt_date, [])
+        if any(provider_lower in name for name in day):
+            log.info("journey: appointment already exists for provider='%s' date=%s — skipping", provider, appt_date)
+            skipped += 1
+            continue
+        day.append(provider_lower)
+
+        notes_parts = []
+        if appt.specialty:
+            notes_parts.append(f"Specialty: {appt.specialty}")
+        if appt.reason:
+            notes_parts.append(f"Reason: {appt.reason}")
+        if appt.location:
+            notes_parts.append(f"Location: {appt.location}")
+
+        to_insert.append({
+            "tenant_id": ctx.tenant_id,
+            "patient_user_id": ctx.user_id,
+            "provider_name": provider or None,
+            "facility_name": appt.location or None,
+            "appointment_date": appt_date + "T09:00:00",  # Default to 9am if no time
+            "notes": "\n".join(notes_parts) or None,
+            "source": "manual",
+        })
+    return to_insert, skipped
+
+
+async def _insert_appointments(
+    db: Client,
+    parsed: list[tuple[FollowUpAppointment, str, str]],
+    ctx: TenantContext,
+) -> dict[str, int]:
+    appts_inserted = 0
+    appts_skipped = 0
+
+    if parsed:
+        dates = [appt_date for _, appt_date, _ in parsed]
         try:
-            # Check if this appointment already exists (same provider + same calendar day)
-            query = (
+            existing = await asyncio.to_thread(
                 db.table("appointments")
-                .select("id")
+                .select("provider_name, appointment_date")
                 .eq("tenant_id", ctx.tenant_id)
                 .eq("patient_user_id", ctx.user_id)
-                .gte("appointment_date", appt_date + "T00:00:00")
-                .lte("appointment_date", appt_date + "T23:59:59")
+                .gte("appointment_date", min(dates) + "T00:00:00")
+                .lte("appointment_date", max(dates) + "T23:59:59")
+                .execute
             )
-            if provider:
-                query = query.ilike("provider_name", f"%{provider}%")
-
-            existing = query.limit(1).execute()
-
-            if existing.data:
-                log.info("journey: appointment already exists for provider='%s' date=%s — skipping", provider, appt_date)
-                appts_skipped += 1
-            else:
-                notes_parts = []
-                if appt.specialty:
-                    notes_parts.append(f"Specialty: {appt.specialty}")
-                if appt.reason:
-                    notes_parts.append(f"Reason: {appt.reason}")
-                if appt.location:
-                    notes_parts.append(f"Location: {appt.location}")
-
-                db.table("appointments").insert({
-                    "tenant_id": ctx.tenant_id,
-                    "patient_user_id": ctx.user_id,
-                    "provider_name": provider or None,
-                    "facility_name": appt.location or None,
-                    "appointment_date": appt_date + "T09:00:00",  # Default to 9am if no time
-                    "notes": "\n".join(notes_parts) or None,
-                    "source": "manual",
-                }).execute()
-                log.info("journey: inserted appointment for provider='%s' date=%s", provider, appt_date)
-                appts_inserted += 1
+            booked: dict[str, list[str]] = {}
+            for r in existing.data or []:
+                booked.setdefault(r["appointment_date"][:10], []).append(
+                    (r.get("provider_name") or "").lower()
+                )
+
+            to_insert, appts_skipped = _new_appointment_rows(parsed, booked, ctx)
+            if to_insert:
+                await asyncio.to_thread(db.table("appointments").insert(to_insert).execute)
+                appts_inserted = len(to_insert)
+                log.info("journey: inserted %d appointment(s)", appts_inserted)
 
         except Exception as exc:
-            log.warning("journey: failed to upsert appointment for '%s' on %s — %s", provider, appt_date, exc)
+            log.warning("journey: failed to upsert %d appointment(s) — %s", len(parsed), exc)
 
     return {
-        "medications_inserted": meds_inserted,
-        "medications_updated": meds_updated,
         "appointments_inserted": appts_inserted,
         "appointments_skipped": appts_skipped,
     }
 
 
+async def _pg_insert_appointments(
+    conn: asyncpg.Connection,
+    parsed: list[tuple[FollowUpAppointment, str, str]],
+    ctx: TenantContext,
+) -> dict[str, int]:
+    if not parsed:
+        return {"appointments_inserted": 0, "appointments_skipped": 0}
+
+    dates = [appt_date for _, appt_date, _ in parsed]
+    existing = await conn.fetch(
+        _SELECT_APPOINTMENTS_SQL,
+        ctx.tenant_id, ctx.user_id,
+        date.fromisoformat(min(dates)), date.fromisoformat(max(dates)),
+    )
+    booked: dict[str, list[str]] = {}
+    for r in existing:
+        booked.setdefault(r["day"].isoformat(), []).append(
+            (r["provider_name"] or "").lower()
+        )
+
+    to_insert, appts_skipped = _new_appointment_rows(parsed, booked, ctx)
+    if to_insert:
+        await conn.executemany(
+            _INSERT_APPOINTMENT_SQL,
+            [
+                (r["tenant_id"], r["patient_user_id"], r["provider_name"],
+                 r["facility_name"], r["appointment_date"], r["notes"], r["source"])
+                for r in to_insert
+            ],
+        )
+        log.info("journey: inserted %d appointment(s)", len(to_insert))
+
+    return {
+        "appointments_inserted": len(to_insert),
+        "appointments_skipped": appts_skipped,
+    }
+
+
 # ── Helpers ────────────────────────────────────────────────────────────────────
 
+def _medication_key(med_name: str) -> str:
+    """Upsert key for a note-derived prescription (see migration 0023)."""
+    return f"medication:{med_name.lower()}"
+
+
 def _format_prescription_content(rx: Prescription) -> str:
     """Build a human-readable content string for a prescription record."""
     parts = [f"Medication: {rx.medication}"]
@@ -196,26 +472,29 @@ def _parse_appointment_date(date_or_timeframe: str | None) -> str | None:
     """
     if not date_or_timeframe:
         return None
+    # Today is part of the cache key: relative timeframes and dates without a
+    # year resolve against it, so yesterday's answers must not be reused.
+    return _parse_appointment_date_cached(date_or_timeframe.strip(), date.today().toordinal())
 
-    text = date_or_timeframe.strip()
 
-    # Try standard date parsing with dateutil
-    try:
-        from dateutil import parser as dateutil_parser
-        parsed = dateutil_parser.parse(text, fuzzy=True)
-        return parsed.date().isoformat()
-    except Exception:
-        pass
+@lru_cache(maxsize=2048)
+def _parse_appointment_date_cached(text: str, today_ordinal: int) -> str | None:
+    # Exact shapes the analysis prompt produces — cheap strptime before dateutil
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
 
-    # Relative timeframes: "in N months", "in N weeks", "in N days"
-    import re
-    m = re.search(r"in\s+(\d+)\s+(day|week|month)s?", text, re.IGNORECASE)
+    today_dt = datetime.combine(date.fromordinal(today_ordinal), datetime.min.time())
+
+    # Relative timeframes: "in N months", "in N weeks", "in N days".
+    # Checked before fuzzy parsing, which would read "in 3 months" as the 3rd.
+    m = _RELATIVE_TIMEFRAME_RE.search(text)
     if m:
         n = int(m.group(1))
         unit = m.group(2).lower()
-        today_dt = datetime.today()
         try:
-            from dateutil.relativedelta import relativedelta
             if unit == "day":
                 future = today_dt + relativedelta(days=n)
             elif unit == "week":
@@ -223,7 +502,12 @@ def _parse_appointment_date(date_or_timeframe: str | None) -> str | None:
             else:
                 future = today_dt + relativedelta(months=n)
             return future.date().isoformat()
-        except Exception:
-            pass
+        except (ValueError, OverflowError):
+            return None
 
-    return None
+    # Last resort: dateutil's fuzzy parser for anything else
+    try:
+        parsed = dateutil_parser.parse(text, fuzzy=True, default=today_dt)
+        return parsed.date().isoformat()
+    except Exception:
+        return None
@@ -14,12 +14,22 @@ with a friendly human-readable message — the endpoint converts this to a 422
 so the frontend can display it instead of a generic error.
 """
 
-import os
-import tempfile
+import warnings
+from functools import lru_cache
 from pathlib import Path
 
 from config import get_settings
 
+# llama-parse emits DeprecationWarnings on import; imported once here so
+# parse_document doesn't pay for the warnings context on every call.
+# Left as None if the package is missing — parse_document reports that.
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        from llama_parse import LlamaParse, ResultType  # type: ignore[import]
+except ImportError:
+    LlamaParse = ResultType = None
+
 settings = get_settings()
 
 # Extensions LlamaParse can handle
@@ -66,34 +76,22 @@ async def parse_document(file_bytes: bytes, filename: str) -> str:
             "Add it to your .env file to enable document parsing."
         )
 
-    try:
-        import warnings
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", DeprecationWarning)
-            from llama_parse import LlamaParse, ResultType  # type: ignore[import]
-    except ImportError as exc:
+    if LlamaParse is None:
         raise RuntimeError(
             "llama-parse is not installed. Run: pip install llama-parse==0.6.9"
-        ) from exc
+        )
+    parser = _get_parser(settings.llama_cloud_api_key)
 
-    # LlamaParse determines file type from the extension, so we write to a named
-    # temp file that preserves the original extension. aload_data also accepts raw
-    # bytes but does not infer file type from content — the extension is required.
-    tmp_path: str | None = None
+    # LlamaParse determines file type from the extension, so raw bytes must be
+    # accompanied by a file_name carrying it. A generic stem keeps the user's
+    # original filename (which may contain a patient name) out of the upload,
+    # as the random temp-file name did before.
     try:
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-            tmp.write(file_bytes)
-            tmp_path = tmp.name
-
-        parser = LlamaParse(
-            api_key=settings.llama_cloud_api_key,
-            result_type=ResultType.MD,
-            verbose=False,
-            show_progress=False,
+        documents = await parser.aload_data(
+            file_bytes,
+            extra_info={"file_name": f"document{ext}"},
         )
 
-        documents = await parser.aload_data(tmp_path)
-
         if not documents:
             raise RuntimeError("LlamaParse returned no content from the document.")
 
@@ -108,9 +106,20 @@ async def parse_document(file_bytes: bytes, filename: str) -> str:
         raise
     except Exception as exc:
         raise RuntimeError(f"Document parsing failed: {exc}") from exc
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except OSError:
-                pass
+
+
+def warm_up() -> None:
+    """Build the shared parser ahead of the first upload (called at app startup)."""
+    if LlamaParse is not None and settings.llama_cloud_api_key:
+        _get_parser(settings.llama_cloud_api_key)
+
+
+@lru_cache(maxsize=1)
+def _get_parser(api_key: str):
+    """One LlamaParse instance per API key, reused across uploads."""
+    return LlamaParse(
+        api_key=api_key,
+        result_type=ResultType.MD,
+        verbose=False,
+        show_progress=False,
+    )
@@ -15,9 +15,15 @@ This drives the agentic post-upload experience:
   - Referral action cards → offer to help schedule with specialist
 """
 
-import json
+import asyncio
+import hashlib
 import logging
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Optional
+
+import tiktoken
 from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
 
@@ -28,6 +34,18 @@ from config import get_settings
 settings = get_settings()
 
 
+# One client per process so its httpx connection pool (and TLS sessions) is
+# reused across uploads instead of rebuilt on every analysis.
+_openai_client: AsyncOpenAI | None = None
+
+
+def _client() -> AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=2)
+    return _openai_client
+
+
 # ── Structured output models ────────────────────────────────────────────────
 
 class Prescription(BaseModel):
@@ -146,20 +164,124 @@ Omit null fields. Arrays may be empty ([]) if nothing was found.
 """
 
 
+# ── Result cache ─────────────────────────────────────────────────────────────
+# Re-uploads of the same document (retries, double-submits) are common and each
+# analysis costs seconds and real money.  Results are memoized in-process by a
+# hash of the note text and the configured model, with a per-key lock so
+# concurrent identical uploads share one OpenAI call.  Bounded LRU so patient
+# content doesn't accumulate in memory.
+_ANALYSIS_CACHE: OrderedDict[str, tuple[float, NoteAnalysisResult]] = OrderedDict()
+_ANALYSIS_LOCKS: dict[str, asyncio.Lock] = {}
+_ANALYSIS_TTL: float = 7 * 24 * 3600.0  # 1 week
+_ANALYSIS_CACHE_MAX: int = 256
+
+
+def _analysis_cache_key(note_text: str) -> str:
+    digest = hashlib.sha256(note_text.encode()).hexdigest()
+    return f"{settings.openai_model}:{digest}"
+
+
+def _cached_analysis(key: str) -> NoteAnalysisResult | None:
+    """Return the unexpired cached result for *key*, refreshing its LRU position."""
+    hit = _ANALYSIS_CACHE.get(key)
+    if hit is None:
+        return None
+    ts, result = hit
+    if time.monotonic() - ts >= _ANALYSIS_TTL:
+        del _ANALYSIS_CACHE[key]
+        return None
+    _ANALYSIS_CACHE.move_to_end(key)
+    return result
+
+
+# ── Prompt truncation ────────────────────────────────────────────────────────
+# Notes are truncated by tokens, not characters: a character cap over-sends
+# dense text and wastes context on plain English.
+_NOTE_TOKEN_BUDGET = 6000
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding | None:
+    """gpt-4o tokenizer, or None if its BPE file can't be loaded (offline host)."""
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as exc:
+        log.warning("analyze_note: tokenizer unavailable, truncating by characters — %s", exc)
+        return None
+
+
+def warm_up() -> None:
+    """Load the tokenizer ahead of the first upload (called at app startup)."""
+    _encoding()
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    # A token is at least one character, so short notes can skip encoding
+    if len(text) <= budget:
+        return text
+    enc = _encoding()
+    if enc is None:
+        return text[:budget * 4]   # ~4 characters per token for English
+    tokens = enc.encode(text)
+    if len(tokens) <= budget:
+        return text
+    return enc.decode(tokens[:budget])
+
+
+# Model ids visible to this API key — filled on first analysis.  If listing
+# fails (e.g. a key without models-list permission) the failure is remembered
+# for _MODELS_FAILURE_TTL so each analysis doesn't repeat the failed call.
+_AVAILABLE_MODELS: set[str] | None = None
+_MODELS_FAILURE_TTL: float = 3600.0
+_MODELS_RETRY_AT: float = 0.0   # time.monotonic() before which we don't re-list
+
+
 # ── Main service function ────────────────────────────────────────────────────
 
 async def analyze_note(note_text: str) -> NoteAnalysisResult:
     """
     Analyze clinical note text and return structured results.
 
+    Identical note text within the cache TTL returns the earlier result
+    without calling OpenAI again.
+    """
+    key = _analysis_cache_key(note_text)
+    result = _cached_analysis(key)
+    if result is not None:
+        log.info("analyze_note: cache hit")
+        return result
+
+    lock = _ANALYSIS_LOCKS.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            result = _cached_analysis(key)   # Another waiter may have filled it
+            if result is None:
+                result = await _analyze_note_uncached(note_text)
+                _ANALYSIS_CACHE[key] = (time.monotonic(), result)
+                while len(_ANALYSIS_CACHE) > _ANALYSIS_CACHE_MAX:
+                    _ANALYSIS_CACHE.popitem(last=False)
+    finally:
+        if not lock.locked():
+            _ANALYSIS_LOCKS.pop(key, None)
+    return result
+
+
+async def _analyze_note_uncached(note_text: str) -> NoteAnalysisResult:
+    """
+    Run the OpenAI analysis for *note_text*.
+
     Uses standard JSON-mode (response_format=json_object) so this works on any
     OpenAI project regardless of which models have beta structured-output access.
     Falls back to gpt-4o-mini if the primary model returns a 403/permission error.
     """
-    client = AsyncOpenAI(api_key=settings.openai_api_key)
+    client = _client()
     primary_model = settings.openai_model
-    # Fallback order: configured model → gpt-4o-mini
+    # Fallback order: configured model → gpt-4o-mini, skipping any model this
+    # project can't use so we don't spend a failed round-trip discovering it
     model_candidates = list(dict.fromkeys([primary_model, "gpt-4o-mini"]))
+    available = await _available_models(client)
+    if available:
+        model_candidates = [m for m in model_candidates if m in available] or model_candidates
 
     messages = [
         {"role": "system", "content": ANALYSIS_SYSTEM},
@@ -167,7 +289,7 @@ async def analyze_note(note_text: str) -> NoteAnalysisResult:
             "role": "user",
             "content": (
                 "Please analyze this clinical note and return the structured JSON result:\n\n"
-                f"{note_text[:8000]}"  # Truncate to keep within context limits
+                f"{_truncate_to_tokens(note_text, _NOTE_TOKEN_BUDGET)}"  # Keep within context limits
             ),
         },
     ]
@@ -184,8 +306,8 @@ async def analyze_note(note_text: str) -> NoteAnalysisResult:
                 max_tokens=2500,
             )
             raw = result.choices[0].message.content or ""
-            data = json.loads(raw)
-            parsed = NoteAnalysisResult(**data)
+            # Parse + validate in one pass through pydantic-core
+            parsed = NoteAnalysisResult.model_validate_json(raw)
             log.info("analyze_note: success with model=%s", model)
             return parsed
         except Exception as exc:
@@ -202,6 +324,28 @@ async def analyze_note(note_text: str) -> NoteAnalysisResult:
     )
 
 
+async def _available_models(client: AsyncOpenAI) -> set[str] | None:
+    """
+    Model ids this API key can use, fetched once per process.
+    None if the list can't be fetched — callers then try candidates blindly.
+    A failed fetch is not retried for _MODELS_FAILURE_TTL seconds.
+    """
+    global _AVAILABLE_MODELS, _MODELS_RETRY_AT
+    if _AVAILABLE_MODELS is None:
+        if time.monotonic() < _MODELS_RETRY_AT:
+            return None
+        try:
+            _AVAILABLE_MODELS = {m.id async for m in client.models.list()}
+        except Exception as exc:
+            _MODELS_RETRY_AT = time.monotonic() + _MODELS_FAILURE_TTL
+            log.warning(
+                "analyze_note: could not list OpenAI models — %s "
+                "(using configured models; retry in %.0fs)", exc, _MODELS_FAILURE_TTL,
+            )
+            return None
+    return _AVAILABLE_MODELS
+
+
 def build_action_cards(analysis: NoteAnalysisResult) -> list[dict]:
     """
     Convert analysis results into frontend action cards.
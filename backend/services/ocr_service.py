@@ -13,11 +13,19 @@ for higher accuracy than the general-purpose layout model.
 
 import re
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, timedelta
+from functools import lru_cache
 from typing import Optional
 
 from config import get_settings
 
+# The Azure SDK is optional — left as None if missing; _doc_client() reports it.
+try:
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    from azure.core.credentials import AzureKeyCredential
+except ImportError:
+    DocumentIntelligenceClient = AzureKeyCredential = None
+
 settings = get_settings()
 
 
@@ -29,28 +37,50 @@ class ExtractedAppointment:
     raw_text: str                # Original sentence from document
 
 
-# Regex patterns for common follow-up phrasings in medical documents
+# Prefer RE2 for the follow-up scans: it runs in linear time with no
+# backtracking, which matters on long multi-page OCR output. The patterns are
+# RE2-compatible (no backreferences), so stdlib re is a drop-in fallback.
+try:
+    import re2 as _re_engine
+except ImportError:
+    _re_engine = re
+
+# Regex patterns for common follow-up phrasings in medical documents.
+# Scanned separately, not as one alternation: the first pattern's lazy .*?
+# can span later phrasings in the space-joined OCR text, and one finditer
+# over an alternation would never report those overlapped matches.
 FOLLOWUP_PATTERNS = [
-    # "Follow up with Dr. Smith in 2 weeks"
-    re.compile(
-        r"follow[\s-]?up\s+(?:with\s+(?P<provider>(?:Dr\.?\s+\w+|[A-Z][a-z]+\s+[A-Z][a-z]+)))?"
+    _re_engine.compile(pattern) for pattern in (
+        # "Follow up with Dr. Smith in 2 weeks"
+        r"(?i)follow[\s-]?up\s+(?:with\s+(?P<provider>(?:Dr\.?\s+\w+|[A-Z][a-z]+\s+[A-Z][a-z]+)))?"
         r".*?(?:in\s+(?P<weeks>\d+)\s+weeks?|on\s+(?P<date>\d{1,2}[/-]\d{1,2}[/-]\d{2,4}))",
-        re.IGNORECASE,
-    ),
-    # "Return to clinic in 14 days"
-    re.compile(
-        r"return\s+(?:to\s+(?:clinic|office|hospital))?\s+"
+        # "Return to clinic in 14 days"
+        r"(?i)return\s+(?:to\s+(?:clinic|office|hospital))?\s+"
         r"(?:in\s+(?P<days>\d+)\s+days?|on\s+(?P<date>\d{1,2}[/-]\d{1,2}[/-]\d{2,4}))",
-        re.IGNORECASE,
-    ),
-    # "Appointment scheduled for March 10, 2026"
-    re.compile(
-        r"appointment\s+(?:scheduled\s+for\s+|on\s+)"
+        # "Appointment scheduled for March 10, 2026"
+        r"(?i)appointment\s+(?:scheduled\s+for\s+|on\s+)"
         r"(?P<date>(?:January|February|March|April|May|June|July|August|September|"
         r"October|November|December)\s+\d{1,2},?\s+\d{4}|\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
-        re.IGNORECASE,
-    ),
+    )
 ]
+_FOLLOWUP_KEYWORDS = ("follow", "return", "appointment")
+
+
+_MONTHS = {
+    name: number
+    for number, name in enumerate(
+        ("january", "february", "march", "april", "may", "june", "july",
+         "august", "september", "october", "november", "december"),
+        start=1,
+    )
+}
+
+# Numeric dates (03/10/2026, 3-10-26) or "March 10, 2026" / "March 10 2026".
+_DATE_RE = re.compile(
+    r"(?P<m1>\d{1,2})(?P<sep>[/-])(?P<d1>\d{1,2})(?P=sep)(?P<y1>\d{4}|\d{2})"
+    rf"|(?P<mon>{'|'.join(_MONTHS)})\s+(?P<d2>\d{{1,2}}),?\s+(?P<y2>\d{{4}})",
+    re.IGNORECASE,
+)
 
 
 def _parse_date_string(raw: str) -> Optional[str]:
@@ -58,31 +88,60 @@ def _parse_date_string(raw: str) -> Optional[str]:
     Attempts to parse various date formats into ISO 8601 (YYYY-MM-DD).
     Returns None if parsing fails.
     """
-    formats = [
-        "%m/%d/%Y", "%m-%d-%Y", "%m/%d/%y", "%m-%d-%y",
-        "%B %d, %Y", "%B %d %Y",
-    ]
-    raw = raw.strip().rstrip(".")
-    for fmt in formats:
-        try:
-            return datetime.strptime(raw, fmt).strftime("%Y-%m-%d")
-        except ValueError:
-            continue
-    return None
+    match = _DATE_RE.fullmatch(raw.strip().rstrip("."))
+    if not match:
+        return None
+
+    if match["m1"]:
+        month, day, year = int(match["m1"]), int(match["d1"]), int(match["y1"])
+        if len(match["y1"]) == 2:
+            # Same pivot as strptime's %y: 69-99 → 1900s, 00-68 → 2000s
+            year += 1900 if year >= 69 else 2000
+    else:
+        month = _MONTHS[match["mon"].lower()]   # regex only admits known names
+        day, year = int(match["d2"]), int(match["y2"])
+
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:  # e.g. 02/30/2026
+        return None
 
 
 def _add_weeks(weeks: int) -> str:
     """Return ISO date string for N weeks from today."""
-    from datetime import date, timedelta
     return (date.today() + timedelta(weeks=weeks)).isoformat()
 
 
 def _add_days(days: int) -> str:
     """Return ISO date string for N days from today."""
-    from datetime import date, timedelta
     return (date.today() + timedelta(days=days)).isoformat()
 
 
+@lru_cache(maxsize=1)
+def _doc_client() -> "DocumentIntelligenceClient":
+    """
+    Process-wide Document Intelligence client. The client owns an HTTP
+    pipeline with connection pooling, so reusing it avoids a fresh TLS
+    handshake per document.
+    """
+    if DocumentIntelligenceClient is None:
+        raise RuntimeError("azure-ai-documentintelligence is not installed.")
+    return DocumentIntelligenceClient(
+        endpoint=settings.azure_doc_intelligence_endpoint,
+        credential=AzureKeyCredential(settings.azure_doc_intelligence_key),
+    )
+
+
+def _join_pages(result) -> str:
+    """Concatenate the text of every line on every page of an analyze result."""
+    # A list (not a generator) lets str.join size the output in one pass
+    return " ".join([
+        line.content
+        for page in (result.pages or [])
+        for line in (page.lines or [])
+    ])
+
+
 async def extract_text_from_bytes(
     document_bytes: bytes,
     content_type: str = "application/pdf",
@@ -95,26 +154,14 @@ async def extract_text_from_bytes(
     if not settings.azure_doc_intelligence_endpoint or not settings.azure_doc_intelligence_key:
         raise RuntimeError("Azure Document Intelligence not configured.")
 
-    from azure.ai.documentintelligence import DocumentIntelligenceClient
-    from azure.core.credentials import AzureKeyCredential
-
-    client = DocumentIntelligenceClient(
-        endpoint=settings.azure_doc_intelligence_endpoint,
-        credential=AzureKeyCredential(settings.azure_doc_intelligence_key),
-    )
-
-    poller = client.begin_analyze_document(
+    poller = _doc_client().begin_analyze_document(
         model_id="prebuilt-layout",
         body=document_bytes,
         content_type=content_type,
     )
     result = poller.result()
 
-    return " ".join(
-        line.content
-        for page in (result.pages or [])
-        for line in (page.lines or [])
-    )
+    return _join_pages(result)
 
 
 async def extract_followup_appointments(
@@ -132,29 +179,14 @@ async def extract_followup_appointments(
         return _extract_with_regex("(Document text extraction requires Azure configuration.)")
 
     try:
-        from azure.ai.documentintelligence import DocumentIntelligenceClient
-        from azure.core.credentials import AzureKeyCredential
-
-        client = DocumentIntelligenceClient(
-            endpoint=settings.azure_doc_intelligence_endpoint,
-            credential=AzureKeyCredential(settings.azure_doc_intelligence_key),
-        )
-
-        poller = client.begin_analyze_document(
+        poller = _doc_client().begin_analyze_document(
             model_id="prebuilt-layout",
             body=document_bytes,
             content_type=content_type,
         )
         result = poller.result()
 
-        # Concatenate all page text
-        full_text = " ".join(
-            line.content
-            for page in (result.pages or [])
-            for line in (page.lines or [])
-        )
-
-        return _extract_with_regex(full_text)
+        return _extract_with_regex(_join_pages(result))
 
     except Exception as exc:
         raise RuntimeError(f"Azure Document Intelligence error: {exc}") from exc
@@ -162,6 +194,12 @@ async def extract_followup_appointments(
 
 def _extract_with_regex(text: str) -> list[ExtractedAppointment]:
     """Apply all follow-up patterns to document text."""
+    # Every pattern starts with one of these words; skip the regex scans
+    # entirely for documents that contain none of them.
+    lowered = text.lower()
+    if not any(keyword in lowered for keyword in _FOLLOWUP_KEYWORDS):
+        return []
+
     appointments: list[ExtractedAppointment] = []
 
     for pattern in FOLLOWUP_PATTERNS:
@@ -13,20 +13,56 @@ Two clients are provided:
                                admin endpoints that check permissions themselves
 """
 
-from supabase import create_client, Client
+from functools import lru_cache
+
+import httpx
+from supabase import create_client, Client, ClientOptions
 from middleware.tenant import TenantContext
 from config import get_settings
 
 settings = get_settings()
 
+# ── Shared HTTP transport ─────────────────────────────────────────────────────
+# create_client() otherwise builds a new httpx.Client (and connection pool)
+# per call, so every per-request scoped client re-paid the TCP/TLS handshake.
+# All clients share this one; auth headers live on each client's PostgREST
+# wrapper and are sent per request, so nothing user-specific is shared.
+# Closed from the app lifespan via close_http_client().
+_HTTP = httpx.Client(
+    http2=True,
+    timeout=120.0,             # supabase-py's default PostgREST timeout
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+)
+
+
+def _create_client(key: str) -> Client:
+    return create_client(
+        settings.supabase_url, key, options=ClientOptions(httpx_client=_HTTP),
+    )
+
+
+def close_http_client() -> None:
+    """Close the shared transport on application shutdown."""
+    _HTTP.close()
 
+
+# Tenant ids whose tenants row this process has already upserted. The row is
+# deterministic from the Auth0 claims, so it only needs provisioning once.
+_PROVISIONED_TENANTS: set[str] = set()
+
+
+@lru_cache(maxsize=1)
 def get_admin_client() -> Client:
     """
     Service-role Supabase client. Bypasses RLS.
     Use with caution — verify authorization in application code before
     calling any query with this client.
+
+    One instance is shared process-wide: it carries no per-request state,
+    and reusing it keeps its HTTP connections alive between requests.
     """
-    return create_client(settings.supabase_url, settings.supabase_service_key)
+    return _create_client(settings.supabase_service_key)
 
 
 def get_scoped_client(ctx: TenantContext) -> Client:
@@ -38,26 +74,32 @@ def get_scoped_client(ctx: TenantContext) -> Client:
     The is_local=True flag scopes each setting to the current transaction,
     preventing session variable leakage between concurrent requests.
 
-    Also auto-provisions the tenants row on first request — the Auth0 action
-    generates a deterministic UUID but does not insert into Supabase directly,
-    so we upsert here using the admin (service-role) client.
+    Also auto-provisions the tenants row on a tenant's first request — the
+    Auth0 action generates a deterministic UUID but does not insert into
+    Supabase directly, so we upsert here using the admin (service-role) client.
     """
-    # Always use the admin client to auto-provision the tenant row (no-op if exists)
-    admin = create_client(settings.supabase_url, settings.supabase_service_key)
-    admin.table("tenants").upsert(
-        {
-            "id":            ctx.tenant_id,
-            "owner_user_id": ctx.user_id,
-            "name":          ctx.user_id,
-        },
-        on_conflict="id",
-    ).execute()
+    # Use the admin client to auto-provision the tenant row, once per tenant
+    # per process (the upsert is a no-op if the row exists)
+    admin = get_admin_client()
+    if ctx.tenant_id not in _PROVISIONED_TENANTS:
+        admin.table("tenants").upsert(
+            {
+                "id":            ctx.tenant_id,
+                "owner_user_id": ctx.user_id,
+                "name":          ctx.user_id,
+            },
+            on_conflict="id",
+        ).execute()
+        _PROVISIONED_TENANTS.add(ctx.tenant_id)
 
     if ctx.raw_token and settings.supabase_anon_key:
         # Production path — pass Auth0 JWT to Supabase so it verifies natively.
         # RLS policies use auth.jwt() which Supabase populates from this token.
         # No manual session variable setting needed.
-        client = create_client(settings.supabase_url, settings.supabase_anon_key)
+        # This client stays per-request (cheap — it rides the shared
+        # transport): postgrest.auth() stores the token on the client, so a
+        # shared instance would leak it across concurrent requests.
+        client = _create_client(settings.supabase_anon_key)
         client.postgrest.auth(ctx.raw_token)
         return client
 
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+
+import httpx
+import msgpack
+import orjson
+
+from services import epic_fhir_service as epic
+
+FHIR_BASE = "https://fhir.example.org/api/FHIR/R4"
+
+CAPABILITY_STATEMENT = {
+    "rest": [{
+        "security": {
+            "extension": [{
+                "extension": [
+                    {"url": "authorize", "valueUri": "https://fhir.example.org/oauth2/authorize"},
+                    {"url": "token", "valueUri": "https://fhir.example.org/oauth2/token"},
+                ],
+            }],
+        },
+    }],
+}
+
+
+def _mock_client(smart_config: dict) -> httpx.AsyncClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/.well-known/smart-configuration"):
+            return httpx.Response(200, content=orjson.dumps(smart_config))
+        if request.url.path.endswith("/metadata"):
+            return httpx.Response(200, content=orjson.dumps(CAPABILITY_STATEMENT))
+        return httpx.Response(404)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_malformed_smart_config_falls_back_to_metadata(monkeypatch):
+    # Valid JSON, but the endpoints are null — SmartConfig validation fails
+    client = _mock_client({"authorization_endpoint": None, "token_endpoint": None})
+    monkeypatch.setattr(epic, "get_client", lambda: client)
+
+    config = asyncio.run(epic._fetch_smart_config(FHIR_BASE, FHIR_BASE))
+
+    assert config.authorization_endpoint == "https://fhir.example.org/oauth2/authorize"
+    assert config.token_endpoint == "https://fhir.example.org/oauth2/token"
+
+
+def test_failed_endpoint_load_is_not_retried_by_queued_callers(monkeypatch):
+    calls = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal calls
+        calls += 1
+        return httpx.Response(503)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(epic, "get_client", lambda: client)
+    monkeypatch.setattr(epic, "_load_local_bundle", lambda: None)
+    monkeypatch.setattr(epic, "_ENDPOINT_LOCK", asyncio.Lock())
+    monkeypatch.setattr(epic, "_ENDPOINT_CACHE_TS", None)
+
+    async def burst():
+        return await asyncio.gather(*(epic.get_endpoints("mercy") for _ in range(5)))
+
+    assert asyncio.run(burst()) == [[]] * 5
+    assert calls == 1
+    assert epic._endpoint_cache_stale() is False
+
+
+class _RecordingQuery:
+    def __init__(self, log: list, table: str):
+        self._log = log
+        self._op = [table]
+
+    def __getattr__(self, name):
+        def step(*args, **kwargs):
+            self._op.append((name, *args))
+            return self
+        return step
+
+    def execute(self):
+        self._log.append(tuple(self._op))
+
+
+class _RecordingDB:
+    def __init__(self):
+        self.ops: list[tuple] = []
+
+    def table(self, name):
+        return _RecordingQuery(self.ops, name)
+
+
+def test_sync_deletes_pre_keyed_copies_before_upserting():
+    fhir_data = {
+        "medications": [{
+            "resourceType": "MedicationRequest", "id": "m1", "status": "active",
+            "medicationCodeableConcept": {"text": "Lisinopril 10 MG"},
+        }],
+        "allergies": [{
+            "resourceType": "AllergyIntolerance", "id": "a1",
+            "clinicalStatus": {"coding": [{"code": "active"}]},
+            "code": {"text": "Penicillin"},
+        }],
+        "appointments": [{
+            "resourceType": "Appointment", "id": "p1", "status": "booked",
+            "start": "2026-11-02T15:00:00Z",
+        }],
+    }
+    db = _RecordingDB()
+
+    asyncio.run(epic.sync_fhir_data_to_db(fhir_data, "t1", "u1", db))
+
+    deletes = [op for op in db.ops if ("delete",) in op]
+    upserts = [op for op in db.ops if op[1][0] == "upsert"]
+    assert len(deletes) == 3 and len(upserts) == 2
+    assert db.ops.index(upserts[0]) > max(db.ops.index(d) for d in deletes)
+
+    by_filter = {next(s[1] for s in op if s[0] == "or_"): op for op in deletes}
+    rx = by_filter[epic._LEGACY_RX_FILTER]
+    assert ("eq", "record_type", "prescription") in rx
+    assert ("in_", "content", ["Medication: Lisinopril 10 MG"]) in rx
+    note = next(op for op in deletes if ("eq", "record_type", "clinical_note") in op)
+    assert ("or_", "external_id.is.null") in note
+    assert ("in_", "content", ["Allergy: Penicillin"]) in note
+    appt = next(op for op in deletes if op[0] == "appointments")
+    assert ("in_", "appointment_date", ["2026-11-02T15:00:00Z"]) in appt
+
+
+def test_smart_config_failure_is_cached_as_fresh_exceptions(monkeypatch):
+    fetches = 0
+
+    async def failing_fetch(base, fhir_base_url):
+        nonlocal fetches
+        fetches += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("no SMART endpoints")
+
+    monkeypatch.setattr(epic, "_fetch_smart_config", failing_fetch)
+    monkeypatch.setattr(epic, "_SMART_CACHE", epic.OrderedDict())
+
+    async def burst():
+        return await asyncio.gather(
+            *(epic.get_smart_config(FHIR_BASE) for _ in range(5)),
+            return_exceptions=True,
+        )
+
+    errors = asyncio.run(burst()) + asyncio.run(burst())
+
+    assert fetches == 1
+    assert all(isinstance(e, ValueError) and str(e) == "no SMART endpoints" for e in errors)
+    assert len({id(e) for e in errors}) == len(errors)
+    assert epic._SMART_LOCKS == {} and epic._SMART_LOCK_USERS == {}
+
+
+def test_index_cache_writers_use_private_temp_files(tmp_path, monkeypatch):
+    index_path = tmp_path / "bundle.idx.msgpack"
+    monkeypatch.setattr(epic, "_INDEX_CACHE_PATH", index_path)
+    payloads = [
+        [{"organization_name": f"H{w}-{i}", "fhir_base_url": "x"} for i in range(2000)]
+        for w in range(4)
+    ]
+
+    threads = [threading.Thread(target=epic._write_index_cache, args=([w], p))
+               for w, p in enumerate(payloads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stamp, endpoints = msgpack.unpackb(index_path.read_bytes(), raw=False)
+    assert endpoints == payloads[stamp[0]]
+    assert [p.name for p in tmp_path.iterdir()] == [index_path.name]
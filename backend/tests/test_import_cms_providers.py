@@ -0,0 +1,106 @@
+import io
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "scripts"))
+
+import import_cms_providers as cms  # noqa: E402
+
+HEADER = (
+    "NPI,Provider Last Name,Provider First Name,Cred\t,Facility Name,pri_spec,"
+    "adr_ln_1,adr_ln_2,City/Town,State,ZIP Code,Telephone Number\n"
+)
+
+
+def _row(npi: str, last: str, state: str = "NJ") -> str:
+    return f"{npi},{last},Ann,MD,,FAMILY PRACTICE,1 Main St,,Newark,{state},071021234,9735551212\n"
+
+
+class _FakeTable:
+    def __init__(self, calls: list[list[dict]]):
+        self._calls = calls
+
+    def upsert(self, rows, on_conflict=None):
+        self._calls.append(rows)
+        return self
+
+    def execute(self):
+        return None
+
+
+class _FakeClient:
+    def __init__(self):
+        self.calls: list[list[dict]] = []
+
+    def table(self, name):
+        return _FakeTable(self.calls)
+
+
+@pytest.fixture(params=["arrow", "csv"])
+def reader_mode(request, monkeypatch):
+    if request.param == "arrow":
+        pytest.importorskip("pyarrow")
+    else:
+        monkeypatch.setattr(cms, "pa", None)
+    return request.param
+
+
+def test_ragged_row_is_skipped_not_fatal(reader_mode, capsys):
+    data = (HEADER + _row("1000000001", "Smith") + "1000000002,Jones,Bob\n"
+            + _row("1000000003", "Lee")).encode()
+    client = _FakeClient()
+
+    cms.import_stream(io.BytesIO(data), client)
+
+    npis = sorted(r["npi"] for batch in client.calls for r in batch)
+    assert npis[0] == "1000000001" and npis[-1] == "1000000003"
+    if reader_mode == "arrow":
+        assert "2 rows imported, 1 skipped" in capsys.readouterr().out
+
+
+class _RacyTable:
+    """Applies each upsert after a random delay, like a slow PostgREST call."""
+
+    def __init__(self, db: dict[str, dict], lock):
+        self._db = db
+        self._lock = lock
+        self._rows: list[dict] = []
+
+    def upsert(self, rows, on_conflict=None):
+        assert len({r["npi"] for r in rows}) == len(rows)   # error 21000 otherwise
+        self._rows = rows
+        return self
+
+    def execute(self):
+        time.sleep(random.uniform(0, 0.005))
+        with self._lock:
+            for r in self._rows:
+                self._db[r["npi"]] = r
+
+
+class _RacyClient:
+    def __init__(self):
+        self.db: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return _RacyTable(self.db, self._lock)
+
+
+def test_last_occurrence_wins_when_npi_spans_batches(reader_mode, monkeypatch):
+    monkeypatch.setattr(cms, "BATCH_SIZE", 2)
+    lines = [_row("1000000001", "Smith")]
+    lines += [_row(f"20000000{i:02d}", "Other") for i in range(60)]
+    lines += [_row("1000000001", "Jones"), _row("1000000001", "Brown")]
+    lines += [_row(f"30000000{i:02d}", "Other") for i in range(60)]
+    client = _RacyClient()
+
+    cms.import_stream(io.BytesIO((HEADER + "".join(lines)).encode()), client)
+
+    assert client.db["1000000001"]["last_name"] == "Brown"
+    assert len(client.db) == 121
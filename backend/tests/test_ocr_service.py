@@ -0,0 +1,18 @@
+from datetime import date, timedelta
+
+from services.ocr_service import _extract_with_regex
+
+
+def test_followup_phrase_does_not_swallow_later_appointments():
+    text = (
+        "Follow up as needed. Appointment scheduled for March 10, 2026. "
+        "Return to clinic in 14 days. Then labs in 2 weeks."
+    )
+    dates = {appt.date for appt in _extract_with_regex(text)}
+
+    assert "2026-03-10" in dates
+    assert (date.today() + timedelta(days=14)).isoformat() in dates
+
+
+def test_no_trigger_words_returns_nothing():
+    assert _extract_with_regex("Vitals stable. Continue current medications.") == []
@@ -17,29 +17,50 @@ python scripts/import_cms_providers.py --csv /path/to/DAC_NationalDownloadableFi
 # Filter to one state only (useful for testing or smaller installs):
 python scripts/import_cms_providers.py --state NJ
 
+# Stream the download into the import without saving the ~400 MB CSV:
+python scripts/import_cms_providers.py --no-disk
+
+# Full import: COPY straight into Postgres instead of JSON upserts via PostgREST
+python scripts/import_cms_providers.py --direct-db
+
 Prerequisites
 -------------
 pip install requests python-dotenv supabase tqdm
+pip install pyarrow        # optional — multi-threaded CSV parsing, much faster
+pip install "psycopg[binary]"   # only for --direct-db
+pip install orjson         # optional — faster JSON encoding of upsert batches
 
 .env (or environment) must have:
   SUPABASE_URL=...
   SUPABASE_SERVICE_KEY=...
+  DATABASE_URL=...          # only for --direct-db (direct Postgres connection string)
 """
 
 import argparse
 import csv
 import io
 import os
+import queue
 import sys
+import threading
 import time
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional
 
 import requests
 from dotenv import load_dotenv
 from supabase import create_client
 from tqdm import tqdm
 
+# pyarrow parses the CSV in C++ across threads; without it we fall back to
+# the stdlib csv module (same output, several times slower on the full file).
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
 # ── Config ────────────────────────────────────────────────────────────────────
 
 DATASET_ID = "mj5m-pzi6"          # CMS Doctors & Clinicians
@@ -48,7 +69,24 @@ METADATA_URL = (
     f"{DATASET_ID}?show-reference-ids=true"
 )
 BATCH_SIZE = 500                   # rows per Supabase upsert
+UPSERT_WORKERS = 8                 # upsert requests in flight at once
+UPSERT_QUEUE_SIZE = 16             # parsed batches waiting, across all uploaders
+
+# cms_providers columns written by the import, in build_row/build_batch order
+PROVIDER_COLUMNS = [
+    "npi", "display_name", "first_name", "last_name", "org_name", "credential",
+    "specialty", "address", "city", "state_abbr", "zip", "phone",
+]
 CHUNK_BYTES = 1024 * 1024          # 1 MB download chunks
+ARROW_BLOCK_BYTES = 64 << 20       # pyarrow CSV read block (~150K rows)
+PROGRESS_MASK = 0x3FFF             # csv path: tick the progress bar every 16K rows
+
+# The only CSV columns build_row reads (names after header whitespace strip)
+CSV_COLUMNS = [
+    "NPI", "Provider First Name", "Provider Last Name", "Cred", "Facility Name",
+    "pri_spec", "adr_ln_1", "adr_ln_2", "City/Town", "State", "ZIP Code",
+    "Telephone Number",
+]
 
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
@@ -97,12 +135,14 @@ def clean(val: Optional[str]) -> Optional[str]:
     return v if v else None
 
 
-def build_row(row: dict) -> Optional[dict]:
+def build_row(row: list[str], idx: dict[str, int]) -> Optional[dict]:
     """Map a CMS CSV row to a cms_providers record.  Returns None to skip.
 
     CMS updated their DAC column names (circa 2024) from short codes to
-    human-readable labels.  We strip all header whitespace first (some headers
-    like "Cred" arrive with trailing tab characters in the downloaded file).
+    human-readable labels.  Fields are read by position: idx maps each
+    CSV_COLUMNS name to its index in row (see _csv_rows, which builds it
+    from the whitespace-stripped header — some headers like "Cred" arrive
+    with trailing tab characters in the downloaded file).
 
     New name  →  Old name
     ---------------------------------
@@ -114,17 +154,14 @@ def build_row(row: dict) -> Optional[dict]:
     ZIP Code             → zip
     Telephone Number     → phn_numbr
     """
-    # Strip trailing whitespace from all keys (some CMS headers contain \t padding)
-    row = {k.strip(): v for k, v in row.items()}
-
-    npi = clean(row.get("NPI"))
+    npi = clean(row[idx["NPI"]])
     if not npi:
         return None
 
-    first = clean(row.get("Provider First Name")) or ""
-    last  = clean(row.get("Provider Last Name"))  or ""
-    cred  = clean(row.get("Cred"))                or ""
-    org   = clean(row.get("Facility Name"))
+    first = clean(row[idx["Provider First Name"]]) or ""
+    last  = clean(row[idx["Provider Last Name"]])  or ""
+    cred  = clean(row[idx["Cred"]])                or ""
+    org   = clean(row[idx["Facility Name"]])
 
     # Build display name: individual = "Cred First Last", org-only = facility name
     full_name = " ".join(p for p in [cred, first, last] if p).strip() or None
@@ -133,12 +170,12 @@ def build_row(row: dict) -> Optional[dict]:
         return None
 
     # Address
-    line1 = clean(row.get("adr_ln_1")) or ""
-    line2 = clean(row.get("adr_ln_2")) or ""
+    line1 = clean(row[idx["adr_ln_1"]]) or ""
+    line2 = clean(row[idx["adr_ln_2"]]) or ""
     address = ", ".join(p for p in [line1, line2] if p) or None
 
     # ZIP: keep 5-digit only
-    zip_raw = clean(row.get("ZIP Code"))
+    zip_raw = clean(row[idx["ZIP Code"]])
     zip5 = zip_raw[:5] if zip_raw else None
 
     return {
@@ -148,76 +185,336 @@ def build_row(row: dict) -> Optional[dict]:
         "last_name":    last  or None,
         "org_name":     org,
         "credential":   cred  or None,
-        "specialty":    clean(row.get("pri_spec")),
+        "specialty":    clean(row[idx["pri_spec"]]),
         "address":      address,
-        "city":         clean(row.get("City/Town")),
-        "state_abbr":   clean(row.get("State")),
+        "city":         clean(row[idx["City/Town"]]),
+        "state_abbr":   clean(row[idx["State"]]),
         "zip":          zip5,
-        "phone":        clean(row.get("Telephone Number")),
+        "phone":        clean(row[idx["Telephone Number"]]),
     }
 
 
+def _read_header(f: BinaryIO) -> list[str]:
+    """Consume the CSV header line and return the stripped column names."""
+    line = f.readline().decode("utf-8-sig")
+    return [h.strip() for h in next(csv.reader([line]))]
+
+
+def _csv_rows(
+    f: BinaryIO,
+    bar: tqdm,
+    state_filter: Optional[str],
+) -> Iterator[Optional[dict]]:
+    """Yield build_row() results using the stdlib csv module.
+
+    The state filter runs on the raw State column first, so build_row only
+    sees rows that can be imported.
+    """
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+
+    # Resolve column positions once.  Columns missing from the header point
+    # one past its end; every row is padded to that width, so short rows and
+    # missing columns both read as "" (clean() → None) without bounds checks.
+    header = [h.strip() for h in next(reader, [])]
+    positions = {name: i for i, name in enumerate(header)}
+    width = len(header) + 1
+    idx = {name: positions.get(name, len(header)) for name in CSV_COLUMNS}
+    state_i = idx["State"]
+
+    n = 0
+    for n, row in enumerate(reader, 1):
+        if not n & PROGRESS_MASK:
+            bar.update(PROGRESS_MASK + 1)
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        if state_filter and row[state_i].strip() != state_filter:
+            continue
+        yield build_row(row, idx)
+    bar.update(n & PROGRESS_MASK)
+
+
+def _clean_column(arr: "pa.Array") -> "pa.Array":
+    """Arrow counterpart of clean(): strip, and null out empty strings."""
+    trimmed = pc.utf8_trim_whitespace(arr)
+    return pc.if_else(pc.equal(trimmed, ""), pa.scalar(None, pa.string()), trimmed)
+
+
+def _join_non_empty(sep: str, *cols: "pa.Array") -> "pa.Array":
+    """sep.join() of the non-null values per row; null when all are null."""
+    # Folded pairwise: binary_join_element_wise's null_handling="skip" drops
+    # all-null rows from its output on some pyarrow releases.
+    joined = cols[0]
+    for col in cols[1:]:
+        both = pc.binary_join_element_wise(joined, col, sep)   # null if either is
+        joined = pc.coalesce(both, joined, col)
+    return joined
+
+
+def build_batch(batch: "pa.RecordBatch", state_filter: Optional[str]) -> "pa.RecordBatch":
+    """Vectorised build_row() over an Arrow record batch.
+
+    Produces the same cms_providers columns as build_row, one Arrow kernel
+    per column, and drops the rows build_row would skip (no NPI, no name)
+    along with any outside state_filter.
+    """
+    col = {name: _clean_column(batch.column(name)) for name in CSV_COLUMNS}
+
+    full_name = _join_non_empty(
+        " ", col["Cred"], col["Provider First Name"], col["Provider Last Name"],
+    )
+    display = pc.coalesce(full_name, col["Facility Name"])
+
+    out = pa.RecordBatch.from_arrays(
+        [
+            col["NPI"],
+            display,
+            col["Provider First Name"],
+            col["Provider Last Name"],
+            col["Facility Name"],
+            col["Cred"],
+            col["pri_spec"],
+            _join_non_empty(", ", col["adr_ln_1"], col["adr_ln_2"]),
+            col["City/Town"],
+            col["State"],
+            pc.utf8_slice_codeunits(col["ZIP Code"], 0, 5),   # 5-digit ZIP only
+            col["Telephone Number"],
+        ],
+        names=PROVIDER_COLUMNS,
+    )
+
+    keep = pc.and_(pc.is_valid(col["NPI"]), pc.is_valid(display))
+    if state_filter:
+        keep = pc.and_(keep, pc.equal(col["State"], state_filter))
+    return out.filter(keep)
+
+
+def _arrow_rows(
+    f: BinaryIO,
+    bar: tqdm,
+    state_filter: Optional[str],
+) -> Iterator[dict]:
+    """Yield cms_providers records, parsing and transforming with pyarrow.
+
+    Only CSV_COLUMNS are converted, and rows are built column-at-a-time by
+    build_batch, so Python dicts are only created for rows being upserted.
+    Rows with the wrong number of fields are skipped (and counted on the
+    progress bar, so they show up as skipped) instead of aborting the read.
+    """
+    invalid = 0
+    invalid_lock = threading.Lock()
+
+    def skip_invalid_row(row) -> str:
+        nonlocal invalid
+        with invalid_lock:   # Arrow may parse blocks on several threads
+            invalid += 1
+        return "skip"
+
+    header = _read_header(f)
+    reader = pa_csv.open_csv(
+        f,
+        read_options=pa_csv.ReadOptions(
+            block_size=ARROW_BLOCK_BYTES, column_names=header,
+        ),
+        parse_options=pa_csv.ParseOptions(invalid_row_handler=skip_invalid_row),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=CSV_COLUMNS,
+            include_missing_columns=True,
+            column_types={c: pa.string() for c in CSV_COLUMNS},
+        ),
+    )
+    counted_invalid = 0
+    for batch in reader:
+        with invalid_lock:
+            new_invalid, counted_invalid = invalid - counted_invalid, invalid
+        bar.update(batch.num_rows + new_invalid)
+        yield from build_batch(batch, state_filter).to_pylist()
+    bar.update(invalid - counted_invalid)
+
+
 def import_file(
     csv_path: Path,
     client,
     state_filter: Optional[str] = None,
+    database_url: Optional[str] = None,
 ) -> None:
-    """Read the CSV and upsert rows into cms_providers in batches."""
-    state_filter = state_filter.upper() if state_filter else None
-
+    """Read the CSV from disk and load rows into cms_providers."""
     print(f"Reading {csv_path}…")
+    with open(csv_path, "rb") as f:
+        import_stream(f, client, state_filter, database_url)
 
-    imported = 0
-    skipped  = 0
-    batch: list[dict] = []
+
+class _ProgressReader(io.RawIOBase):
+    """Raw byte stream over an HTTP response body that ticks a tqdm bar."""
+
+    def __init__(self, raw, bar: tqdm) -> None:
+        self._raw = raw
+        self._bar = bar
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._raw.readinto(b)
+        self._bar.update(n)
+        return n
+
+
+def import_url(
+    url: str,
+    client,
+    state_filter: Optional[str] = None,
+    database_url: Optional[str] = None,
+) -> None:
+    """Stream the CSV from the CMS download straight into the importer.
+
+    Nothing is written to disk, and parsing/upserting overlaps the
+    download.  There is no local copy to resume from if it fails, though.
+    """
+    print(f"Streaming from:\n  {url}")
+    with requests.get(url, stream=True, timeout=120) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True   # undo any Content-Encoding while reading
+        total = int(r.headers.get("content-length", 0))
+        with tqdm(total=total, unit="B", unit_scale=True, desc="Downloading") as dl:
+            stream = io.BufferedReader(_ProgressReader(r.raw, dl), CHUNK_BYTES)
+            import_stream(stream, client, state_filter, database_url)
+
+
+def import_stream(
+    f: BinaryIO,
+    client,
+    state_filter: Optional[str] = None,
+    database_url: Optional[str] = None,
+) -> None:
+    """Parse CSV bytes from f and load rows into cms_providers.
+
+    Rows go through batched PostgREST upserts, or through COPY on a direct
+    Postgres connection when database_url is given.
+    """
+    state_filter = state_filter.upper() if state_filter else None
 
     # f.tell() is disabled by csv's line iterator, so track progress by row count
-    with open(csv_path, newline="", encoding="utf-8-sig") as f, tqdm(
-        unit=" rows", desc="Importing"
-    ) as bar:
-        reader = csv.DictReader(f)
-        for raw in reader:
-            bar.update(1)
-
-            r = build_row(raw)
-            if r is None:
-                skipped += 1
-                continue
-            if state_filter and r.get("state_abbr") != state_filter:
-                skipped += 1
-                continue
-
-            batch.append(r)
+    with tqdm(unit=" rows", desc="Importing") as bar:
+        # Both readers apply state_filter before building rows
+        read = _arrow_rows if pa else _csv_rows
+        rows = (r for r in read(f, bar, state_filter) if r is not None)
+        if database_url:
+            imported = _copy_rows(database_url, rows)
+        else:
+            imported = _upsert_rows(client, rows)
+
+    skipped = bar.n - imported
+    print(f"\nDone — {imported:,} rows imported, {skipped:,} skipped.")
+
+
+def _upsert_rows(client, rows: Iterator[dict]) -> int:
+    """Upsert rows through PostgREST in BATCH_SIZE batches.  Returns the row count.
+
+    This thread parses and batches (producer); UPSERT_WORKERS threads upsert
+    (consumers).  Parsing only stalls when an uploader's queue is full, so
+    total time approaches max(parse, upload) rather than their sum.
+
+    Each NPI is routed to one uploader by hash, and each uploader sends its
+    batches in the order they were filled.  So every write for a given NPI
+    happens on one thread, in file order: the last occurrence in the file
+    wins, and concurrent upserts never touch the same row (no lock-order
+    deadlocks between them).
+    """
+    queues: list[queue.Queue[Optional[list[dict]]]] = [
+        queue.Queue(maxsize=UPSERT_QUEUE_SIZE // UPSERT_WORKERS)
+        for _ in range(UPSERT_WORKERS)
+    ]
+    errors: list[Exception] = []
+
+    def uploader(batches: queue.Queue) -> None:
+        while (chunk := batches.get()) is not None:
+            try:
+                _upsert(client, chunk)
+            except Exception as exc:   # _upsert handles API errors; this is a bug
+                errors.append(exc)
+
+    workers = [
+        threading.Thread(target=uploader, args=(q,), daemon=True) for q in queues
+    ]
+    for w in workers:
+        w.start()
+
+    # Pending batches (one per uploader) are keyed by NPI as they fill: the
+    # CMS CSV repeats NPIs (one row per specialty/address) and PostgreSQL
+    # rejects a PK twice in one ON CONFLICT upsert (error 21000).
+    imported = 0
+    pending: list[dict[str, dict]] = [{} for _ in range(UPSERT_WORKERS)]
+    try:
+        for r in rows:
+            worker = hash(r["npi"]) % UPSERT_WORKERS
+            batch = pending[worker]
+            batch[r["npi"]] = r
 
             if len(batch) >= BATCH_SIZE:
-                _upsert(client, batch)
+                queues[worker].put(list(batch.values()))
                 imported += len(batch)
-                batch = []
+                pending[worker] = {}
 
-    if batch:
-        _upsert(client, batch)
-        imported += len(batch)
+        for worker, batch in enumerate(pending):
+            if batch:
+                queues[worker].put(list(batch.values()))
+                imported += len(batch)
+    finally:
+        for q in queues:
+            q.put(None)   # stop sentinel
+        for w in workers:
+            w.join()
 
-    print(f"\nDone — {imported:,} rows imported, {skipped:,} skipped.")
+    if errors:
+        raise errors[0]
+    return imported
 
 
-def _upsert(client, batch: list[dict], retries: int = 3) -> None:
-    """Upsert a batch, deduplicating by NPI first.
+def _copy_rows(database_url: str, rows: Iterator[dict]) -> int:
+    """Bulk-load rows with COPY into a staging table, then merge in one statement.
 
-    The CMS CSV contains duplicate NPI rows (same provider listed under
-    multiple specialties or addresses).  PostgreSQL raises error 21000
-    if the same PK appears twice in a single ON CONFLICT upsert — we
-    deduplicate within each batch to prevent this.  Last occurrence wins.
+    Skips PostgREST entirely: COPY streams rows in Postgres' own wire
+    format, and the single INSERT … ON CONFLICT is planned once instead of
+    per batch.  Duplicate NPIs are resolved in the merge (last occurrence
+    wins, same as _upsert).  Everything runs in one transaction, so a
+    failed import leaves cms_providers untouched.  Returns the row count.
     """
-    # Deduplicate within batch: keep last row for each NPI
-    deduped: dict[str, dict] = {}
-    for row in batch:
-        deduped[row["npi"]] = row
-    clean_batch = list(deduped.values())
+    import psycopg   # optional: only needed for --direct-db
+
+    cols = ", ".join(PROVIDER_COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in PROVIDER_COLUMNS if c != "npi")
+    imported = 0
 
+    with psycopg.connect(database_url) as conn, conn.cursor() as cur:
+        cur.execute(
+            "CREATE TEMP TABLE cms_providers_staging ("
+            "seq bigserial, "
+            + ", ".join(f"{c} text" for c in PROVIDER_COLUMNS)
+            + ") ON COMMIT DROP"
+        )
+        with cur.copy(f"COPY cms_providers_staging ({cols}) FROM STDIN") as copy:
+            for r in rows:
+                copy.write_row([r[c] for c in PROVIDER_COLUMNS])
+                imported += 1
+
+        print("\nMerging staged rows into cms_providers…")
+        cur.execute(
+            f"INSERT INTO cms_providers ({cols}) "
+            f"SELECT DISTINCT ON (npi) {cols} FROM cms_providers_staging "
+            f"ORDER BY npi, seq DESC "
+            f"ON CONFLICT (npi) DO UPDATE SET {updates}"
+        )
+
+    return imported
+
+
+def _upsert(client, batch: list[dict], retries: int = 3) -> None:
+    """Upsert a batch with retries.  The batch must not repeat an NPI
+    (_upsert_rows dedupes while building it)."""
     for attempt in range(retries):
         try:
-            client.table("cms_providers").upsert(clean_batch, on_conflict="npi").execute()
+            client.table("cms_providers").upsert(batch, on_conflict="npi").execute()
             return
         except Exception as exc:
             if attempt < retries - 1:
@@ -226,12 +523,44 @@ def _upsert(client, batch: list[dict], retries: int = 3) -> None:
                 print(f"  [WARN] batch upsert failed after {retries} attempts: {exc}")
 
 
+def _use_orjson_for_request_bodies() -> None:
+    """Encode PostgREST request bodies with orjson instead of stdlib json.
+
+    supabase-py passes upsert rows to httpx as json=..., which httpx encodes
+    with json.dumps — a measurable share of CPU when 8 upsert threads are
+    busy.  This swaps httpx's body encoder for orjson.  It is a no-op if
+    orjson is missing or httpx no longer exposes the hook.
+    """
+    try:
+        import orjson
+        from httpx import _content
+    except ImportError:
+        return
+    if not (hasattr(_content, "encode_json") and hasattr(_content, "ByteStream")):
+        return
+
+    def encode_json(json):
+        body = orjson.dumps(json)
+        headers = {"Content-Length": str(len(body)), "Content-Type": "application/json"}
+        return headers, _content.ByteStream(body)
+
+    _content.encode_json = encode_json
+
+
 # ── Main ──────────────────────────────────────────────────────────────────────
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Import CMS provider data into Supabase")
     parser.add_argument("--csv",   help="Path to a pre-downloaded DAC_NationalDownloadableFile.csv")
     parser.add_argument("--state", help="Only import providers for this state (e.g. NJ, CA)")
+    parser.add_argument(
+        "--direct-db", action="store_true",
+        help="Load via COPY over DATABASE_URL instead of PostgREST upserts",
+    )
+    parser.add_argument(
+        "--no-disk", action="store_true",
+        help="Stream the download straight into the import instead of saving the CSV first",
+    )
     args = parser.parse_args()
 
     # Load .env from wellbridge/ root (one level up from scripts/)
@@ -241,16 +570,25 @@ def main() -> None:
     else:
         load_dotenv()
 
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_key = os.environ.get("SUPABASE_SERVICE_KEY")
+    database_url = None
+    if args.direct_db:
+        database_url = os.environ.get("DATABASE_URL")
+        if not database_url:
+            print("WARNING: --direct-db needs DATABASE_URL; falling back to Supabase upserts")
 
-    if not supabase_url or not supabase_key:
-        print("ERROR: SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in .env")
-        sys.exit(1)
+    client = None
+    if not database_url:
+        supabase_url = os.environ.get("SUPABASE_URL")
+        supabase_key = os.environ.get("SUPABASE_SERVICE_KEY")
+
+        if not supabase_url or not supabase_key:
+            print("ERROR: SUPABASE_URL and SUPABASE_SERVICE_KEY must be set in .env")
+            sys.exit(1)
 
-    client = create_client(supabase_url, supabase_key)
+        client = create_client(supabase_url, supabase_key)
+        _use_orjson_for_request_bodies()
 
-    # Resolve the CSV path
+    # Resolve the CSV source
     if args.csv:
         csv_path = Path(args.csv)
         if not csv_path.exists():
@@ -264,9 +602,12 @@ def main() -> None:
             except Exception as exc:
                 print(f"ERROR discovering download URL: {exc}")
                 sys.exit(1)
+            if args.no_disk:
+                import_url(url, client, state_filter=args.state, database_url=database_url)
+                return
             download_csv(url, csv_path)
 
-    import_file(csv_path, client, state_filter=args.state)
+    import_file(csv_path, client, state_filter=args.state, database_url=database_url)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+-- ==============================================================================
+-- 0022: FHIR resource ids on Epic-synced rows
+--
+-- external_id — "<ResourceType>/<id>" of the FHIR resource a row was synced
+--               from (e.g. "MedicationRequest/eXyZ123").  NULL for uploaded or
+--               manually created rows.
+--
+-- The unique indexes let sync_fhir_data_to_db() write each table with a single
+-- bulk ON CONFLICT upsert instead of a per-row DELETE + INSERT.  NULLs are
+-- distinct in a unique index, so rows without an external_id never conflict.
+--
+-- Rows synced before this migration can't be backfilled, because the old sync
+-- never stored the FHIR id.  sync_fhir_data_to_db() instead deletes the
+-- un-keyed copy of each row it is about to upsert (exact content match), so
+-- the first re-sync replaces those rows rather than duplicating them.
+-- ==============================================================================
+
+ALTER TABLE patient_records
+    ADD COLUMN IF NOT EXISTS external_id TEXT;
+
+ALTER TABLE appointments
+    ADD COLUMN IF NOT EXISTS external_id TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_records_external_id
+    ON patient_records (tenant_id, patient_user_id, record_type, external_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_appt_external_id
+    ON appointments (tenant_id, patient_user_id, external_id);
@@ -0,0 +1,34 @@
+-- ==============================================================================
+-- 0023: Upsert keys for prescriptions extracted from uploaded notes
+--
+-- journey_update_service writes note-derived prescriptions with
+-- external_id = 'medication:' || lower(<medication name>), so a re-upload that
+-- mentions the same medication hits idx_records_external_id (0022) and a whole
+-- batch of prescriptions becomes one bulk ON CONFLICT upsert.
+--
+-- Backfill the key on existing uploaded prescriptions.  Only the newest row per
+-- (tenant, patient, medication) gets it — older duplicates keep a NULL key so
+-- the unique index is not violated; they remain visible but stop being updated.
+-- ==============================================================================
+
+UPDATE patient_records pr
+SET    external_id = k.medication_key
+FROM (
+    SELECT DISTINCT ON (tenant_id, patient_user_id, lower(btrim(provider_name)))
+           id,
+           'medication:' || lower(btrim(provider_name)) AS medication_key
+    FROM   patient_records
+    WHERE  record_type = 'prescription'
+      AND  external_id IS NULL
+      AND  provider_name IS NOT NULL
+      AND  btrim(provider_name) <> ''
+    ORDER  BY tenant_id, patient_user_id, lower(btrim(provider_name)), note_date DESC
+) k
+WHERE  pr.id = k.id
+  AND  NOT EXISTS (
+           SELECT 1 FROM patient_records x
+           WHERE  x.tenant_id = pr.tenant_id
+             AND  x.patient_user_id = pr.patient_user_id
+             AND  x.record_type = 'prescription'
+             AND  x.external_id = k.medication_key
+       );
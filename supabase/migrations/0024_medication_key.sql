@@ -0,0 +1,25 @@
+-- ==============================================================================
+-- 0024: Normalized medication name on patient_records
+--
+-- medication_key — lower(btrim(provider_name)), maintained by Postgres.  For
+--                  prescription rows provider_name holds the medication name,
+--                  so this is the case-insensitive identity of a medication.
+--
+-- journey_update_service looks up existing prescriptions by equality on this
+-- column (B-tree index) instead of ILIKE '%name%', which needed a sequential
+-- scan and also matched substrings ("aspirin" inside "aspirin/dipyridamole").
+-- It covers Epic-synced prescriptions as well as uploaded ones, so a note that
+-- mentions a medication Epic already synced updates that row rather than
+-- listing the medication twice.
+--
+-- Not UNIQUE: Epic can legitimately hold several MedicationRequests for the
+-- same drug.  Upsert uniqueness stays on idx_records_external_id (0022/0023).
+-- ==============================================================================
+
+ALTER TABLE patient_records
+    ADD COLUMN IF NOT EXISTS medication_key TEXT
+    GENERATED ALWAYS AS (lower(btrim(provider_name))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_records_medication_key
+    ON patient_records (tenant_id, patient_user_id, medication_key)
+    WHERE record_type = 'prescription';